@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""Time the descendant axis over documents of the same size and
+increasing depth: the cost per node should stay flat.
+
+Run with `make benchmark` from the top of the source tree.
+
+"""
+import time
+from xml.dom import minidom
+
+from dominic import xpath
+
+NODES = 20000
+REPEAT = 5
+
+def document(depth):
+    """Build a document of NODES elements, as chains of 'depth'
+    nested elements."""
+    doc = minidom.Document()
+    root = doc.appendChild(doc.createElement('root'))
+    for i in xrange(NODES // depth):
+        parent = root
+        for j in xrange(depth):
+            parent = parent.appendChild(doc.createElement('node'))
+    return doc
+
+def best(function, *args):
+    times = []
+    for i in xrange(REPEAT):
+        start = time.time()
+        function(*args)
+        times.append(time.time() - start)
+    return min(times)
+
+def main():
+    descendant = xpath.expr.axes['descendant']
+    print '%8s %12s' % ('depth', 'usec/node')
+    for depth in (1, 10, 100, 1000, 5000):
+        doc = document(depth)
+        count = len(list(descendant(doc)))
+        elapsed = best(lambda: list(descendant(doc)))
+        print '%8d %12.3f' % (depth, elapsed / count * 1e6)
+
+if __name__ == '__main__':
+    main()
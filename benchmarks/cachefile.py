@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Compare the time a process takes to compile its selectors and
+expressions with the time it takes to load them from a cache file saved
+by dominic.save_cache().
+
+Run with `make benchmark` from the top of the source tree.
+
+"""
+import os
+import tempfile
+import time
+
+from dominic import xpath, compile_selector, save_cache, load_cache
+from dominic.css import selector_cache
+
+REPEAT = 5
+
+# A few hundred selectors and expressions, as a worker would start with:
+# selectors matched natively and selectors translated to XPath.
+SELECTORS = (['div#c%d > ul.items li.i%d a[href^="/x%d"]' % (i, i, i)
+              for i in xrange(150)] +
+             ['h%d ~ p + span.s%d' % (i % 6 + 1, i) for i in xrange(150)])
+EXPRESSIONS = ['//section[@id = "s%d"]/item[position() < %d and '
+               'contains(@class, "odd")]' % (i, i) for i in xrange(200)]
+
+def clear():
+    selector_cache.clear()
+    xpath.XPath.cache.clear()
+
+def compile_all():
+    for selector in SELECTORS:
+        compile_selector(selector)
+    for expression in EXPRESSIONS:
+        xpath.XPath.get(expression).compile()
+
+def best(function, *args):
+    times = []
+    for i in xrange(REPEAT):
+        clear()
+        start = time.time()
+        function(*args)
+        times.append(time.time() - start)
+    return min(times)
+
+def main():
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        clear()
+        compile_all()
+        save_cache(filename)
+        compiled = best(compile_all)
+        loaded = best(load_cache, filename)
+    finally:
+        os.remove(filename)
+    print '%-10s %10s' % ('startup', 'time')
+    print '%-10s %9.3fs' % ('compile', compiled)
+    print '%-10s %9.3fs' % ('load', loaded)
+    print '%-10s %9.2fx' % ('speedup', compiled / loaded)
+
+if __name__ == '__main__':
+    main()
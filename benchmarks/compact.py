@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Compare a minidom document with a CompactDocument holding the same
+tree: memory per node, parse time, and the time of a few queries.
+
+Run with `make benchmark` from the top of the source tree.
+
+"""
+import multiprocessing
+import resource
+import time
+from xml.dom import minidom
+
+from dominic import xpath
+from dominic.xpath.compact import CompactDocument
+
+SECTIONS = 2000
+QUERIES = ['//item[@class="odd"]', '//section/item[last()]',
+           '//item/following-sibling::item', 'count(//text())',
+           '//section[contains(., "7")]']
+
+def source():
+    parts = ['<doc>']
+    for i in xrange(SECTIONS):
+        parts.append('<section id="s%d">' % i)
+        for j in xrange(10):
+            parts.append('<item class="%s">item %d.%d</item>' %
+                         (('even', 'odd')[j % 2], i, j))
+        parts.append('</section>')
+    parts.append('</doc>')
+    return ''.join(parts)
+
+BUILDERS = {
+    'minidom': minidom.parseString,
+    'compact': CompactDocument.fromstring,
+}
+
+def measure(name, string, results):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    doc = BUILDERS[name](string)
+    parse_time = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    nodes = len(xpath.find('//node() | //@*', doc)) + 1
+    times = []
+    for query in QUERIES:
+        start = time.time()
+        xpath.find(query, doc)
+        times.append(time.time() - start)
+    results.put((name, (after - before) * 1024.0 / nodes, parse_time, times))
+
+def main():
+    string = source()
+    results = multiprocessing.Queue()
+    print '%-8s %10s %8s  %s' % ('backend', 'bytes/node', 'parse',
+                                 '  '.join(QUERIES))
+    for name in ('minidom', 'compact'):
+        # Each document is built in a fresh process, so that the growth
+        # of its peak memory usage is that of the document alone.
+        process = multiprocessing.Process(target=measure,
+                                          args=(name, string, results))
+        process.start()
+        name, size, parse_time, times = results.get()
+        process.join()
+        print '%-8s %10d %7.3fs  %s' % (name, size, parse_time,
+                                        '  '.join('%.3fs' % x for x in times))
+
+if __name__ == '__main__':
+    main()
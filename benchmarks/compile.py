@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Compare the throughput of expressions interpreted by walking their
+expression tree with that of the same expressions compiled by
+XPath.compile().
+
+The expressions are those the tests of paths, predicates, functions and
+axes evaluate, as collected by benchmarks/engine.py, evaluated from the
+document element of the document it generates by default.  Only
+predicates and the expressions outside of location paths are compiled
+into closures: the steps of a path are evaluated as they are
+interpreted, so that path-heavy expressions gain little or nothing.
+
+Run with `make benchmark` from the top of the source tree.
+
+"""
+import time
+from xml.dom import minidom
+
+from dominic import xpath
+from engine import collect_expressions, source
+
+SIZE = 10
+DEPTH = 4
+FANOUT = 4
+REPEAT = 3
+# Evaluations timed together, as most expressions take microseconds.
+NUMBER = 10
+
+def best(function, *args):
+    times = []
+    for i in xrange(REPEAT):
+        start = time.time()
+        for j in xrange(NUMBER):
+            function(*args)
+        times.append(time.time() - start)
+    return min(times) / NUMBER
+
+def same(a, b):
+    """Return true if two values of an expression are the same, NaN
+    included."""
+    return a == b or (a != a and b != b)
+
+def main():
+    markup, elements = source(SIZE, DEPTH, FANOUT)
+    root = minidom.parseString(markup).documentElement
+    print '%d elements' % elements
+    print '%-50s %12s %12s %8s' % ('expression', 'interpreted', 'compiled',
+                                   'speedup')
+    for module, expression in collect_expressions():
+        interpreted = xpath.XPath(expression)
+        compiled = xpath.XPath(expression).compile()
+        try:
+            expected = interpreted.find(root)
+        except xpath.XPathError, e:
+            print '%-50s  %s: %s' % (expression[:50], e.__class__.__name__,
+                                     str(e)[:30])
+            continue
+        assert same(compiled.find(root), expected), expression
+        before = best(interpreted.find, root)
+        after = best(compiled.find, root)
+        print '%-50s %11.5fs %11.5fs %7.2fx' % (expression[:50], before,
+                                                after,
+                                                before / after if after
+                                                else 0)
+
+if __name__ == '__main__':
+    main()
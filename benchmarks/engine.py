@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""Measure the XPath engine, expression by expression, on synthetic
+documents.
+
+The expressions are those the tests of paths, predicates, functions and
+axes evaluate: their test cases are run first, and the expressions they
+left in XPath.cache collected.  Each one is then evaluated from the
+document element of a generated document, whose shape is given by the
+number of sections under it (--size), their depth (--depth) and the
+number of children of each element (--fanout).  For every expression,
+the benchmark reports:
+
+    parse        the best time to parse it, in milliseconds;
+    evaluate     the best time to evaluate it on a minidom document;
+    visited      the number of nodes the engine moved to, counted on a
+                 CompactDocument of the same markup;
+    allocations  the number of container objects allocated and not
+                 freed by one evaluation, as counted by the garbage
+                 collector (the result included).
+
+Expressions which can't be evaluated on the document (unknown variables
+or namespace prefixes) are reported with their error.  --json writes the
+results to a file ('-' for the standard output), for --compare to
+report the evaluation speedup of a later run over them.
+
+Run with `make benchmark` from the top of the source tree.
+
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import unittest
+from xml.dom import minidom
+
+import dominic
+from dominic import xpath
+from dominic.xpath.compact import CompactDocument
+
+REPEAT = 3
+
+TEST_MODULES = ['tests.xpath.test_paths', 'tests.xpath.test_predicates',
+                'tests.xpath.test_functions', 'tests.xpath.test_axes']
+
+# The element names the expressions of the tests look for, given in turn
+# to the children of each element.
+NAMES = ['para', 'chapter', 'section', 'item', 'div', 'title', 'group',
+         'li', 'appendix', 'ul', 'a', 'figure', 'olist', 'p']
+
+class CountingDocument(CompactDocument):
+    """A CompactDocument counting the node handles asked for."""
+
+    __slots__ = ('visited',)
+
+    def __init__(self):
+        CompactDocument.__init__(self)
+        self.visited = 0
+
+    def node(self, index):
+        self.visited += 1
+        return CompactDocument.node(self, index)
+
+def collect_expressions():
+    """Run the test cases of TEST_MODULES, returning the (module,
+    expression) pairs of the expressions they evaluated, in the order
+    they were first evaluated."""
+    cache = xpath.XPath.cache
+    capacity = cache.capacity
+    cache.clear()
+    cache.capacity = sys.maxint
+    expressions = []
+    seen = set()
+    try:
+        for name in TEST_MODULES:
+            suite = unittest.defaultTestLoader.loadTestsFromName(name)
+            suite.run(unittest.TestResult())
+            for expression in cache.keys():
+                if expression not in seen:
+                    seen.add(expression)
+                    expressions.append((name.split('.')[-1], expression))
+    finally:
+        cache.clear()
+        cache.capacity = capacity
+    return expressions
+
+def source(size, depth, fanout):
+    """Return the markup of a document of 'size' sections of 'depth'
+    levels of elements, each element having 'fanout' children, with
+    numbered ids, alternating types and some text."""
+    parts = ['<doc>']
+    counter = [0]
+
+    def element(name, level):
+        counter[0] += 1
+        n = counter[0]
+        parts.append('<%s id="%d" type="%s" name="n%d">' %
+                     (name, n, ('warning', 'note')[n % 2], n))
+        if level < depth:
+            for i in xrange(fanout):
+                element(NAMES[(level + i) % len(NAMES)], level + 1)
+        else:
+            parts.append('text %d' % n)
+        if n % 10 == 0:
+            parts.append('<!-- comment %d -->' % n)
+        parts.append('</%s>' % name)
+
+    for i in xrange(size):
+        element('section', 1)
+    parts.append('</doc>')
+    return ''.join(parts), counter[0]
+
+def best(function, *args):
+    times = []
+    for i in xrange(REPEAT):
+        start = time.time()
+        function(*args)
+        times.append(time.time() - start)
+    return min(times)
+
+def describe(value):
+    """Describe the value of an expression, for the report."""
+    if isinstance(value, list):
+        return '%d nodes' % len(value)
+    return repr(value)[:20]
+
+def measure(expression, root, counting):
+    """Return the measures of an expression, evaluated from 'root' and
+    from the same element of the 'counting' document."""
+    parse = best(xpath.XPath, expression)
+    expr = xpath.XPath(expression)
+    try:
+        value = expr.find(root)
+    except xpath.XPathError, e:
+        error = '%s: %s' % (e.__class__.__name__, e)
+        return {'parse': parse, 'error': error}
+    evaluate = best(expr.find, root)
+
+    counting.visited = 0
+    try:
+        expr.find(counting.documentElement)
+    except xpath.XPathError:
+        visited = None
+    else:
+        visited = counting.visited
+
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        value = expr.find(root)
+        allocations = gc.get_count()[0] - before
+    finally:
+        if enabled:
+            gc.enable()
+
+    return {'parse': parse, 'evaluate': evaluate, 'visited': visited,
+            'allocations': allocations, 'result': describe(value)}
+
+def run(size, depth, fanout):
+    markup, elements = source(size, depth, fanout)
+    root = minidom.parseString(markup).documentElement
+    counting = CountingDocument.fromstring(markup)
+    results = []
+    for module, expression in collect_expressions():
+        result = measure(expression, root, counting)
+        result.update({'module': module, 'expression': expression})
+        results.append(result)
+    return {
+        'version': dominic.version,
+        'python': sys.version.split()[0],
+        'document': {'size': size, 'depth': depth, 'fanout': fanout,
+                     'elements': elements},
+        'repeat': REPEAT,
+        'results': results,
+    }
+
+def report(results, previous=None):
+    before = {}
+    if previous is not None:
+        for result in previous['results']:
+            if 'evaluate' in result:
+                before[result['expression']] = result['evaluate']
+
+    document = results['document']
+    print ('dominic %s, %d elements (size %d, depth %d, fanout %d)' %
+           (results['version'], document['elements'], document['size'],
+            document['depth'], document['fanout']))
+    header = '%-45s %9s %9s %9s %7s' % ('expression', 'parse ms', 'eval ms',
+                                        'visited', 'allocs')
+    if before:
+        header += ' %8s' % 'speedup'
+    print header
+    for result in results['results']:
+        line = '%-45s %9.3f' % (result['expression'][:45],
+                                result['parse'] * 1000)
+        if 'error' in result:
+            print '%s  %s' % (line, result['error'][:40])
+            continue
+        visited = result['visited']
+        line += ' %9.3f %9s %7d' % (result['evaluate'] * 1000,
+                                     '-' if visited is None else visited,
+                                     result['allocations'])
+        old = before.get(result['expression'])
+        if old is not None and result['evaluate']:
+            line += ' %7.2fx' % (old / result['evaluate'])
+        print line
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=10,
+                        help='sections under the document element')
+    parser.add_argument('--depth', type=int, default=4,
+                        help='levels of elements in each section')
+    parser.add_argument('--fanout', type=int, default=4,
+                        help='children of each element')
+    parser.add_argument('--json', metavar='FILE',
+                        help="write the results as JSON ('-' for stdout)")
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare with the results of an earlier run')
+    args = parser.parse_args()
+
+    results = run(args.size, args.depth, args.fanout)
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        return
+    if args.json:
+        f = open(args.json, 'w')
+        try:
+            json.dump(results, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+    previous = None
+    if args.compare:
+        f = open(args.compare)
+        try:
+            previous = json.load(f)
+        finally:
+            f.close()
+    report(results, previous)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Compare the parse throughput of XPath expressions tokenized by the
+yapps scanner with that of the combined scanner of xpath.scanner, and of
+the yapps parser with that of the precedence parser of xpath.pratt.
+
+Run with `make benchmark` from the top of the source tree.
+
+"""
+import time
+
+import xpath.parser
+import xpath.pratt
+import xpath.scanner
+
+REPEAT = 200
+
+EXPRESSIONS = [
+    '//para',
+    '/doc/chapter[5]/section[2]',
+    '//item[@class = "odd"][position() < 3]',
+    'count(//item[number(@n) * 2 > 10]) div sum(//item/@n)',
+    '//section[@id = "s1"]/item[contains(@class, "odd") and position() < 3 '
+    'or string-length(normalize-space(.)) > 10][last()]'
+    '/following-sibling::item[@n != 2 and not(@hidden)]/@n',
+    'ancestor-or-self::*[@xml:lang][1]/@xml:lang | '
+    'preceding::comment()[1] | following::processing-instruction("pi")',
+]
+
+def yapps(scanner):
+    return xpath.parser.XPath(scanner).XPath()
+
+def pratt(scanner):
+    return xpath.pratt.XPathParser(scanner).parse()
+
+PARSERS = [
+    ('yapps', xpath.parser.XPathScanner, yapps),
+    ('combined', xpath.scanner.XPathScanner, yapps),
+    ('pratt', xpath.scanner.XPathScanner, pratt),
+]
+
+def parse(scanner, parser, expression):
+    """Parse an expression, returning the tokens it was made of."""
+    s = scanner(expression)
+    parser(s)
+    return s.tokens
+
+def main():
+    print '%-10s %12s %12s' % ('parser', 'parses/sec', 'tokens/sec')
+    for name, scanner, parser in PARSERS:
+        tokens = sum(len(parse(scanner, parser, x)) for x in EXPRESSIONS)
+        start = time.time()
+        for i in xrange(REPEAT):
+            for expression in EXPRESSIONS:
+                parse(scanner, parser, expression)
+        elapsed = time.time() - start
+        print '%-10s %12.0f %12.0f' % (name,
+                                       REPEAT * len(EXPRESSIONS) / elapsed,
+                                       REPEAT * tokens / elapsed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Measure what importing dominic costs a fresh interpreter: the time the
+import takes, the time to answer a first query, and the modules it loads.
+
+Each measure is taken in a new process, as `python -X importtime` would
+on Python 3, the best of REPEAT runs being kept.
+
+Run with `make benchmark` from the top of the source tree.
+
+"""
+import compileall
+import os
+import subprocess
+import sys
+
+REPEAT = 10
+
+IMPORT = """
+import time
+start = time.time()
+import dominic
+print time.time() - start
+"""
+
+FIRST_QUERY = """
+import time
+start = time.time()
+import dominic
+dom = dominic.DOM('<ul><li id="a">a</li><li>b</li></ul>')
+dom.find('li#a')
+dom.xpath('//li[@id = "a"]')
+print time.time() - start
+"""
+
+# Modules only needed by some features, which importing dominic should
+# leave to be imported when first used.
+DEFERRED = ['xpath.parser', 'xml.sax', 'xml.dom.pulldom', 'multiprocessing',
+            'tempfile', 'fractions', 'decimal', 'cPickle', 'threading']
+
+MODULES = """
+import sys
+before = set(sys.modules)
+import dominic
+loaded = set(k for k in sys.modules if sys.modules[k] is not None)
+print len(loaded - before)
+print ' '.join(m for m in %r if m in loaded)
+""" % (DEFERRED,)
+
+def run(code):
+    env = dict(os.environ)
+    path = [os.getcwd(), os.path.join(os.getcwd(), 'dominic')]
+    env['PYTHONPATH'] = os.pathsep.join(
+        path + filter(None, [env.get('PYTHONPATH')]))
+    process = subprocess.Popen([sys.executable, '-c', code], env=env,
+                               stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError('benchmark process failed')
+    return output
+
+def best(code):
+    return min(float(run(code)) for i in xrange(REPEAT))
+
+def main():
+    # Compile the modules, as they would be once installed.
+    compileall.compile_dir('dominic', quiet=1)
+    count, loaded = run(MODULES).split('\n')[:2]
+    print '%-20s %9.1fms' % ('import dominic', best(IMPORT) * 1000)
+    print '%-20s %9.1fms' % ('first query', best(FIRST_QUERY) * 1000)
+    print '%-20s %11s' % ('modules imported', count)
+    print '%-20s %11s' % ('deferred, imported', loaded or 'none')
+
+if __name__ == '__main__':
+    main()
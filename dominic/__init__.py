@@ -26,14 +26,25 @@
 
 version = '0.1.4-alpha'
 
+import os
+import time
+from collections import MutableSequence
 from xml.dom import minidom
-from xml.sax import make_parser
-from xml.sax.handler import ErrorHandler
+from xml.parsers import expat
 
 from dominic import xpath
-from dominic.css import XPathTranslator
+from dominic.css import XPathTranslator, SelectorSyntaxError
+from dominic.css import compile_selector, selector_cache, parse_selector
+from dominic.matcher import Matcher, find_many, supported
 
-class FaultTolerantErrorHandler(ErrorHandler):
+class FaultTolerantErrorHandler(object):
+    """A SAX error handler ignoring every error.
+
+    It implements xml.sax.handler.ErrorHandler without deriving from it,
+    for xml.sax to be imported only once a document needs the tolerant
+    parser.
+
+    """
     def error(self, exception):
         pass
     def fatalError(self, exception):
@@ -41,31 +52,138 @@ class FaultTolerantErrorHandler(ErrorHandler):
     def warning(self, exception):
         pass
 
-def string_to_minidom(string):
+# How documents were parsed: the number built by each builder, the number
+# the 'auto' strategy found malformed, and the time spent checking and
+# building them, in seconds.
+parse_stats = {}
+
+def reset_parse_stats():
+    parse_stats.update({
+        'strict': 0,
+        'tolerant': 0,
+        'malformed': 0,
+        'check_time': 0.0,
+        'strict_time': 0.0,
+        'tolerant_time': 0.0,
+    })
+
+reset_parse_stats()
+
+def well_formed(string):
+    """Return true if 'string' is a well-formed XML document, checking
+    it with a bare expat parser configured like the one minidom uses,
+    without building anything."""
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.ExternalEntityRefHandler = lambda *args: 1
     try:
-        dom = minidom.parseString(string)
-    except:
-        faulty = make_parser()
-        faulty.setErrorHandler(FaultTolerantErrorHandler())
-        dom = minidom.parseString(string, parser=faulty)
+        parser.Parse(string, True)
+    except expat.ExpatError:
+        return False
+    return True
+
+def strict_parse(string):
+    start = time.time()
+    dom = minidom.parseString(string)
+    parse_stats['strict'] += 1
+    parse_stats['strict_time'] += time.time() - start
+    return dom
 
+def tolerant_parse(string):
+    from xml.sax import make_parser
+    start = time.time()
+    faulty = make_parser()
+    faulty.setErrorHandler(FaultTolerantErrorHandler())
+    dom = minidom.parseString(string, parser=faulty)
+    parse_stats['tolerant'] += 1
+    parse_stats['tolerant_time'] += time.time() - start
     return dom
 
+def string_to_minidom(string, strategy='auto'):
+    """Parse a document into minidom.
+
+    With the 'strict' strategy, malformed documents raise an exception.
+    The 'tolerant' strategy builds every document through the fault
+    tolerant SAX parser.  The 'auto' strategy checks documents first, and
+    only builds the malformed ones through the tolerant parser.
+
+    """
+    if strategy == 'strict':
+        return strict_parse(string)
+    elif strategy == 'tolerant':
+        return tolerant_parse(string)
+    elif strategy != 'auto':
+        raise ValueError("unknown parse strategy %r" % strategy)
+
+    start = time.time()
+    ok = well_formed(string)
+    parse_stats['check_time'] += time.time() - start
+    if ok:
+        try:
+            return strict_parse(string)
+        except:
+            pass
+    parse_stats['malformed'] += 1
+    return tolerant_parse(string)
+
 class Element(object):
     def __init__(self, element):
         self.element = element
-        self.tag = element.tagName
+
+    # Elements wrapping the same node are equal, for those wrapped again
+    # by an ElementSet to be found in it.
+    def __eq__(self, other):
+        return isinstance(other, Element) and other.element is self.element
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.element)
+
+    @property
+    def tag(self):
+        return self.element.tagName
 
     def xpath(self, path):
-        finder = xpath.XPath(path)
+        finder = xpath.XPath.get(path)
         return ElementSet(finder.find(self.element))
 
     def find(self, selector):
-        xpather = XPathTranslator(selector)
-        return self.xpath(xpather.path)
+        finder = compile_selector(selector)
+        return ElementSet(finder.find(self.element))
+
+    def find_many(self, selectors):
+        """Find the elements matching each of a dict of selectors, with a
+        single traversal of the document for all the selectors that can
+        be matched natively.  Returns a dict of ElementSets, with the
+        same keys."""
+        compiled = dict((name, compile_selector(selector))
+                        for name, selector in selectors.iteritems())
+        matchers = dict((name, finder) for name, finder in compiled.iteritems()
+                        if isinstance(finder, Matcher))
+        found = find_many(self.element, matchers)
+        for name, finder in compiled.iteritems():
+            if name not in matchers:
+                found[name] = finder.find(self.element)
+        return dict((name, ElementSet(nodes))
+                    for name, nodes in found.iteritems())
 
     def get(self, selector):
-        return self.find(selector)[0]
+        """Return the first element matching a selector, without looking
+        for the others when it is matched natively."""
+        finder = compile_selector(selector)
+        if isinstance(finder, Matcher):
+            node = finder.first(self.element)
+        else:
+            node = finder.findnode(self.element)
+        if node is None:
+            raise IndexError("no element matches %r" % selector)
+        return Element(node)
+
+    def exists(self, selector):
+        """Return true if any element matches a selector, stopping at the
+        first one."""
+        return compile_selector(selector).exists(self.element)
 
     def _get_element_text(self):
         ret = self.element.childNodes[0].wholeText
@@ -73,6 +191,7 @@ class Element(object):
 
     def text(self, new=None):
         if isinstance(new, basestring):
+            xpath.invalidate(self.element)
             self.element.childNodes[0].replaceWholeText(new)
 
         return self._get_element_text()
@@ -86,6 +205,7 @@ class Element(object):
             while self.element.childNodes:
                 self.element.childNodes.pop()
 
+            xpath.invalidate(self.element)
             html = string_to_minidom(new)
             node = html.childNodes[0]
             self.element.parentNode.replaceChild(node, self.element)
@@ -95,6 +215,7 @@ class Element(object):
 
     def attr(self, key=None, value=None):
         if key and value:
+            xpath.invalidate(self.element)
             self.element.setAttribute(key, value)
             return
 
@@ -104,15 +225,84 @@ class Element(object):
         return self.attribute.copy()
 
     def remove_attr(self, attr):
+        xpath.invalidate(self.element)
         self.element.removeAttribute(attr)
 
     def _fetch_attributes(self, element):
         keys = element.attributes.keys()
         return dict([(k, element.getAttribute(k)) for k in keys])
 
-class ElementSet(list):
-    def __init__(self, items):
-        super(ElementSet, self).__init__(map(Element, items))
+class ElementSet(MutableSequence):
+    """A list of the elements found by a query.
+
+    The set holds the DOM nodes themselves, and only wraps them in
+    Element objects as they are accessed.  It supports the operations of
+    a list, which take and return Elements.
+
+    """
+    def __init__(self, nodes=()):
+        self._nodes = [unwrap(x) for x in nodes]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return ElementSet(self._nodes[i])
+        return Element(self._nodes[i])
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            self._nodes[i] = [unwrap(x) for x in value]
+        else:
+            self._nodes[i] = unwrap(value)
+
+    def __delitem__(self, i):
+        del self._nodes[i]
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def insert(self, i, element):
+        self._nodes.insert(i, unwrap(element))
+
+    def __iter__(self):
+        for node in self._nodes:
+            yield Element(node)
+
+    def __reversed__(self):
+        for node in reversed(self._nodes):
+            yield Element(node)
+
+    def __contains__(self, element):
+        return unwrap(element) in self._nodes
+
+    def index(self, element, *args):
+        return self._nodes.index(unwrap(element), *args)
+
+    def count(self, element):
+        return self._nodes.count(unwrap(element))
+
+    def __add__(self, other):
+        return ElementSet(self._nodes + [unwrap(x) for x in other])
+
+    def __radd__(self, other):
+        return ElementSet([unwrap(x) for x in other] + self._nodes)
+
+    def __eq__(self, other):
+        if not isinstance(other, (ElementSet, list, tuple)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'ElementSet(%r)' % self._nodes
+
+    @property
+    def nodes(self):
+        """The DOM nodes of the elements, as a list."""
+        return list(self._nodes)
 
     def first(self):
         return self[0]
@@ -124,8 +314,108 @@ class ElementSet(list):
     def length(self):
         return len(self)
 
+def unwrap(element):
+    """Return the DOM node of an Element, or the node itself."""
+    if isinstance(element, Element):
+        return element.element
+    return element
+
 class DOM(Element):
-    def __init__(self, raw):
+    def __init__(self, raw, strategy='auto'):
+        """Parse 'raw' with the given strategy: 'strict', 'tolerant' or
+        'auto' (see string_to_minidom)."""
         self.raw = raw
-        self.document = string_to_minidom(raw)
+        self.document = string_to_minidom(raw, strategy)
         self.element = self.document.childNodes[0]
+        xpath.name_index(self.document)
+
+    @property
+    def context(self):
+        """The XPathContext shared by the queries on the document."""
+        return xpath.document_context(self.document)
+
+    @property
+    def index(self):
+        """Elements of the document by tag name, id and class, built on
+        first use."""
+        return xpath.name_index(self.document)
+
+def iterfind(source, selector):
+    """Parse a document incrementally, yielding an Element for each
+    element matching a CSS selector, in document order.
+
+    'source' is a file name or a file object.  Only the ancestors of the
+    element being parsed are kept in memory, along with the subtree of
+    each matching element, which is detached from the document and made
+    the document element of a document of its own: find(), get() and
+    exists() on the elements yielded search that subtree.  Those
+    subtrees are built through SAX, which leaves comments out.
+
+    Selectors with sibling combinators can't be matched while streaming,
+    and raise ValueError.
+
+    """
+    from xml.dom import pulldom
+    from xml.sax import make_parser
+    from xml.sax.handler import feature_external_ges
+
+    selectors = parse_selector(selector)
+    if not supported(selectors):
+        raise ValueError("%r can't be matched while streaming" % selector)
+    matcher = Matcher(selectors)
+    descendants = xpath.expr.axes['descendant']
+
+    # Like minidom.parseString(), don't fetch external DTDs.
+    parser = make_parser()
+    parser.setFeature(feature_external_ges, False)
+    events = pulldom.parse(source, parser=parser)
+    namespace = None
+    # The elements being parsed, each one attached to the previous one
+    # for the combinators to find its ancestors.
+    ancestors = []
+    for event, node in events:
+        if event == pulldom.START_ELEMENT:
+            if ancestors:
+                ancestors[-1].appendChild(node)
+            else:
+                attr = node.getAttributeNode('xmlns')
+                if attr is not None:
+                    namespace = attr.value
+
+            if matcher.match(node, namespace):
+                events.expandNode(node)
+                found = [node] + [x for x in descendants(node)
+                                  if x.nodeType == x.ELEMENT_NODE and
+                                  matcher.match(x, namespace)]
+                node.parentNode.removeChild(node)
+                own_document(node, namespace)
+                for x in found:
+                    yield Element(x)
+            else:
+                ancestors.append(node)
+
+        elif event == pulldom.END_ELEMENT:
+            node = ancestors.pop()
+            node.parentNode.removeChild(node)
+
+def own_document(node, namespace):
+    """Make the detached element 'node' the document element of a new
+    document, declaring 'namespace' as its default namespace."""
+    document = minidom.Document()
+    document.appendChild(node)
+    for x in [node] + list(xpath.expr.axes['descendant'](node)):
+        x.ownerDocument = document
+        if x.nodeType == x.ELEMENT_NODE:
+            for attr in x.attributes.values():
+                attr.ownerDocument = document
+    # The namespace declared on the document element of the source.
+    context = xpath.document_context(document)
+    if context.default_namespace is None:
+        context.default_namespace = namespace
+    return document
+
+from dominic.bulk import bulk_extract
+from dominic.cachefile import save_cache, load_cache
+
+if os.environ.get('DOMINIC_CACHE'):
+    load_cache(os.environ['DOMINIC_CACHE'])
@@ -0,0 +1,143 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <dominic - python-pure implementation of CSS Selectors>
+# Copyright (C) <2010>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+from dominic import DOM, xpath
+from dominic.css import compile_selector
+
+# The selectors of the bulk_extract() call a worker process serves, as
+# set by init_worker().
+worker_selectors = None
+
+def normalize(selectors):
+    """Return the selectors of a bulk_extract() call as a dict of
+    (selector, attribute) pairs, attribute being None to extract text."""
+    normalized = {}
+    for name, selector in selectors.iteritems():
+        if isinstance(selector, basestring):
+            selector = (selector, None)
+        normalized[name] = tuple(selector)
+    return normalized
+
+def init_worker(selectors):
+    """Compile the selectors once, for all the documents this process
+    will extract values from.  They must have been compiled by the parent
+    process first: a worker raising here is started over by the pool,
+    again and again."""
+    global worker_selectors
+    worker_selectors = selectors
+    for selector, attribute in selectors.itervalues():
+        compile_selector(selector)
+
+def read(source):
+    """Return the document 'source', read from a file unless it already
+    is markup."""
+    if source.lstrip().startswith('<'):
+        return source
+    f = open(source, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def extract(job):
+    """Extract the values of every selector from a document, returning
+    an (index, values, error) triple: the error of a document which can't
+    be read or parsed is described in 'error', with None for 'values'."""
+    index, source, strategy = job
+    # Described rather than returned, as exceptions don't all survive
+    # being sent back from a worker process.
+    try:
+        dom = DOM(read(source), strategy)
+    except Exception, e:
+        return index, None, '%s: %s' % (e.__class__.__name__, e)
+    found = dom.find_many(dict((name, selector) for name, (selector, _)
+                               in worker_selectors.iteritems()))
+    values = {}
+    for name, (selector, attribute) in worker_selectors.iteritems():
+        nodes = found[name].nodes
+        if attribute is None:
+            values[name] = [xpath.expr.string_value(x) for x in nodes]
+        else:
+            values[name] = [x.getAttribute(attribute)
+                            if x.hasAttribute(attribute) else None
+                            for x in nodes]
+    return index, values, None
+
+def bulk_extract(sources, selectors, workers=None, ordered=True,
+                 chunksize=16, strategy='auto'):
+    """Extract values from many documents, across a pool of processes.
+
+    'sources' is an iterable of documents, each one given as markup or as
+    the name of the file holding it.  'selectors' maps names to either a
+    CSS selector, to extract the text of the matching elements, or a
+    (selector, attribute) pair, to extract the value of one of their
+    attributes (None where they don't have it).
+
+    Yields an (index, values, error) triple per document, 'index' being
+    its position in 'sources' and 'values' a dict mapping the selector
+    names to lists of values.  A document which can't be read or parsed
+    doesn't stop the others: its 'values' are None, and 'error' describes
+    the exception raised, being None otherwise.  Unless 'ordered' is
+    false, documents are yielded in the order of 'sources'.  Documents
+    are sent to the 'workers' processes (one per CPU by default, none to
+    extract in this process) by chunks of 'chunksize', and parsed with
+    the given strategy (see DOM).
+
+    Invalid selectors raise SelectorSyntaxError when bulk_extract() is
+    called, before any process is started.
+
+    """
+    selectors = normalize(selectors)
+    for selector, attribute in selectors.itervalues():
+        compile_selector(selector)
+    return extract_all(sources, selectors, workers, ordered, chunksize,
+                       strategy)
+
+def extract_all(sources, selectors, workers, ordered, chunksize, strategy):
+    """Yield the results of bulk_extract(), for selectors known to be
+    valid."""
+    jobs = ((index, source, strategy)
+            for index, source in enumerate(sources))
+
+    if workers == 0:
+        init_worker(selectors)
+        for job in jobs:
+            yield extract(job)
+        return
+
+    # Imported here, as importing it is not cheap, for pools only.
+    import multiprocessing
+    pool = multiprocessing.Pool(workers, init_worker, (selectors,))
+    try:
+        if ordered:
+            results = pool.imap(extract, jobs, chunksize)
+        else:
+            results = pool.imap_unordered(extract, jobs, chunksize)
+        for result in results:
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,126 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <dominic - python-pure implementation of CSS Selectors>
+# Copyright (C) <2010>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+"""Compiled selectors and expressions saved to a file, for processes to
+start with them instead of parsing them again.
+
+save_cache() writes the CSS selectors of css.selector_cache, with their
+XPath translation, and the expressions of xpath.XPath.cache, as their
+expression trees.  load_cache() puts them back into the caches, as long as
+the file was written by the same version of dominic; the file of another
+version is ignored.
+
+The file holds two pickles: a header naming the version of dominic which
+wrote it, which is checked before anything else is read, then the
+selectors and expressions, whose classes may not exist in other versions.
+
+When the DOMINIC_CACHE environment variable names a cache file, it is
+loaded when dominic is imported.
+
+"""
+import os
+
+from dominic import version, xpath
+from dominic.css import selector_cache
+from dominic.matcher import Matcher
+
+MAGIC = 'dominic cache'
+
+def save_cache(filename):
+    """Save the compiled selectors and expressions to a file."""
+    expressions = []
+    for key, expr, cost in xpath.XPath.cache.entries():
+        expressions.append((key, expr.expr, expr.compiled, cost))
+    selectors = []
+    for key, compiled, cost in selector_cache.entries():
+        if isinstance(compiled, Matcher):
+            selectors.append((key, 'css', compiled.selectors, cost))
+        else:
+            selectors.append((key, 'xpath', compiled.expr, cost))
+    state = {'expressions': expressions, 'selectors': selectors}
+
+    import cPickle as pickle
+    import tempfile
+    # The file is replaced at once, for processes loading it meanwhile
+    # never to read part of it.
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(filename) or '.')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            pickle.dump((MAGIC, version), f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(temp, filename)
+    except:
+        os.remove(temp)
+        raise
+
+def load_cache(filename):
+    """Load the compiled selectors and expressions saved to a file.
+
+    Returns the number of selectors and expressions loaded, which is 0
+    when the file doesn't exist, was saved by another version or can't be
+    read: such a cache is stale, and is left alone.
+
+    """
+    import cPickle as pickle
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        return 0
+    try:
+        try:
+            if pickle.load(f) != (MAGIC, version):
+                return 0
+            expressions, selectors = compile_state(pickle.load(f))
+        except Exception:
+            return 0
+    finally:
+        f.close()
+
+    for key, expr, cost in expressions:
+        xpath.XPath.cache.add(key, expr, cost)
+    for key, compiled, cost in selectors:
+        selector_cache.add(key, compiled, cost)
+    return len(expressions) + len(selectors)
+
+def compile_state(state):
+    """Return the (key, compiled, cost) triples of the expressions and of
+    the selectors of a saved cache."""
+    expressions = []
+    for key, expr, compiled, cost in state['expressions']:
+        expr = xpath.XPath(expr)
+        if compiled:
+            expr.compile()
+        expressions.append((key, expr, cost))
+    selectors = []
+    for key, kind, value, cost in state['selectors']:
+        if kind == 'css':
+            compiled = Matcher(value)
+        else:
+            compiled = xpath.XPath(value).compile()
+        selectors.append((key, compiled, cost))
+    return expressions, selectors
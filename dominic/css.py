@@ -24,98 +24,299 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 # OTHER DEALINGS IN THE SOFTWARE.
 import re
+import time
+
+from dominic import xpath
+from dominic.matcher import Matcher, supported
+
+X = xpath.expr
+
+class SelectorSyntaxError(xpath.XPathParseError):
+    """Raised when a CSS selector could not be parsed."""
+
+    def __str__(self):
+        return ("Syntax error, %s:\n" % self.err +
+                self.expr.replace("\n", " ") + "\n" +
+                ("-" * self.pos) + "^")
+
+class Compound(object):
+    """A compound selector: a type selector (or '*') followed by any
+    number of id, class and attribute selectors, e.g. 'li.geometry#ball'.
+
+    'attributes' holds (name, operator, value) triples; the operator and
+    value are None for [name] selectors.
+
+    """
+    def __init__(self, tag='*'):
+        self.tag = tag
+        self.ids = []
+        self.classes = []
+        self.attributes = []
+
+    def __str__(self):
+        s = self.tag
+        s += ''.join('#%s' % x for x in self.ids)
+        s += ''.join('.%s' % x for x in self.classes)
+        for name, op, value in self.attributes:
+            if op is None:
+                s += '[%s]' % name
+            else:
+                s += '[%s%s"%s"]' % (name, op, value)
+        return s
+
+class Selector(object):
+    """A complex selector: compound selectors joined by combinators.
+
+    'steps' is a list of (combinator, Compound) pairs, from left to right.
+    The combinator of the first pair is None; the others are ' ' for
+    descendants, '>' for children, '+' for adjacent siblings and '~' for
+    general siblings.
+
+    """
+    def __init__(self, steps):
+        self.steps = steps
+
+    def __str__(self):
+        s = str(self.steps[0][1])
+        for combinator, compound in self.steps[1:]:
+            if combinator == ' ':
+                s += ' %s' % compound
+            else:
+                s += ' %s %s' % (combinator, compound)
+        return s
+
+# Tokens of the selector grammar, matched at the current parser position.
+NAME = re.compile(r'(?:[\w\-]|[^\x00-\x7f]|\\.)+', re.UNICODE)
+SPACE = re.compile(r'\s*')
+COMBINATOR = re.compile(r'\s*([>+~,])\s*|\s+')
+MATCH = re.compile(r'\s*([~|^$*]?=)\s*')
+STRING = re.compile(r'"([^"]*)"|\'([^\']*)\'')
+VALUE = re.compile(r'[^\]\s"\']+')
+ESCAPE = re.compile(r'\\(.)')
+
+class SelectorParser(object):
+    """Recursive descent parser for groups of CSS selectors.
+
+    The selector string is read once, from left to right, and parsed into
+    a list of Selector objects.
+
+    """
+    def __init__(self, selector):
+        self.input = selector
+        self.pos = 0
+
+    def error(self, message):
+        raise SelectorSyntaxError(self.input, self.pos, message)
+
+    def match(self, regex):
+        m = regex.match(self.input, self.pos)
+        if m is not None:
+            self.pos = m.end()
+        return m
+
+    def peek(self):
+        return self.input[self.pos:self.pos+1]
+
+    def parse(self):
+        self.match(SPACE)
+        selectors = [self.selector()]
+        while self.peek() == ',':
+            self.pos += 1
+            self.match(SPACE)
+            selectors.append(self.selector())
+        if self.pos < len(self.input):
+            self.error('unexpected "%s"' % self.peek())
+        return selectors
+
+    def selector(self):
+        steps = [(None, self.compound())]
+        while True:
+            m = self.match(COMBINATOR)
+            if m is None:
+                break
+            combinator = m.group(1) or ' '
+            if self.pos == len(self.input):
+                if combinator == ' ':
+                    break
+                self.error('expected a selector')
+            if combinator == ',':
+                self.pos = m.start(1)
+                break
+            steps.append((combinator, self.compound()))
+        return Selector(steps)
+
+    def name(self):
+        m = self.match(NAME)
+        if m is None:
+            self.error('expected a name')
+        return ESCAPE.sub(r'\1', m.group(0))
+
+    def compound(self):
+        if self.peek() == '*':
+            self.pos += 1
+            compound = Compound('*')
+        elif NAME.match(self.input, self.pos):
+            compound = Compound(self.name())
+        else:
+            compound = None
+
+        while True:
+            c = self.peek()
+            if c not in ('#', '.', '['):
+                break
+            if compound is None:
+                compound = Compound()
+            self.pos += 1
+            if c == '#':
+                compound.ids.append(self.name())
+            elif c == '.':
+                compound.classes.append(self.name())
+            else:
+                compound.attributes.append(self.attribute())
+
+        if compound is None:
+            self.error('expected a selector')
+        return compound
+
+    def attribute(self):
+        self.match(SPACE)
+        name = self.name()
+        op = value = None
+        m = self.match(MATCH)
+        if m is not None:
+            op = m.group(1)
+            m = self.match(STRING) or self.match(VALUE)
+            if m is None:
+                self.error('expected an attribute value')
+            value = [x for x in m.groups() if x is not None] or [m.group(0)]
+            value = value[0]
+        self.match(SPACE)
+        if self.peek() != ']':
+            self.error('expected "]"')
+        self.pos += 1
+        return name, op, value
+
+def parse_selector(selector):
+    """Parse a group of CSS selectors into a list of Selector objects."""
+    return SelectorParser(selector).parse()
+
+#
+# Translation of parsed selectors into XPath expression trees.
+#
+
+def attribute_step(name):
+    return X.AxisStep('attribute', X.NameTest(None, name))
+
+def call(name, *args):
+    return X.Function(name, list(args))
+
+def literal(value):
+    return X.LiteralExpr(value)
+
+def token_test(name, token):
+    """Whitespace separated 'token' in the attribute 'name'."""
+    padded = call('concat', literal(' '),
+                  call('normalize-space', attribute_step(name)),
+                  literal(' '))
+    return call('contains', padded, literal(' %s ' % token))
+
+def attribute_test(name, op, value):
+    attr = attribute_step(name)
+    if op is None:
+        return attr
+    elif op == '=':
+        return X.EqualityExpr('=', attr, literal(value))
+    elif op == '~=':
+        return token_test(name, value)
+    elif op == '^=':
+        return call('starts-with', attr, literal(value))
+    elif op == '$=':
+        return call('ends-with', attr, literal(value))
+    elif op == '*=':
+        return call('contains', attr, literal(value))
+    elif op == '|=':
+        return call('starts-with', attr, literal(value + '-'))
+
+def compound_predicates(compound):
+    predicates = []
+    for id in compound.ids:
+        predicates.append(X.EqualityExpr('=', attribute_step('id'),
+                                         literal(id)))
+    for cls in compound.classes:
+        predicates.append(token_test('class', cls))
+    for name, op, value in compound.attributes:
+        predicates.append(attribute_test(name, op, value))
+    return predicates
+
+def compound_step(compound, axis='child'):
+    step = X.AxisStep(axis, X.NameTest(None, compound.tag))
+    predicates = compound_predicates(compound)
+    if predicates:
+        step = X.PredicateList(step, predicates, axis)
+    return step
+
+def selector_expr(selector):
+    """Return the XPath expression tree selecting the same elements as a
+    parsed Selector."""
+    steps = []
+    for combinator, compound in selector.steps:
+        if combinator in (None, ' '):
+            steps.append(X.AxisStep('descendant-or-self'))
+            steps.append(compound_step(compound))
+        elif combinator == '>':
+            steps.append(compound_step(compound))
+        elif combinator == '~':
+            steps.append(compound_step(compound, 'following-sibling'))
+        elif combinator == '+':
+            sibling = X.AxisStep('following-sibling', X.NameTest(None, '*'))
+            steps.append(X.PredicateList(sibling, [literal(1.0)],
+                                         'following-sibling'))
+            steps.append(compound_step(compound, 'self'))
+    return X.AbsolutePathExpr(X.PathExpr(steps))
+
+def selectors_expr(selectors):
+    """Return the expression tree for a group of parsed selectors."""
+    expr = selector_expr(selectors[0])
+    for selector in selectors[1:]:
+        expr = X.UnionExpr('|', expr, selector_expr(selector))
+    return expr
 
 class XPathTranslator(object):
     def __init__(self, selector):
         self.selector = selector
 
+    @property
+    def expr(self):
+        return selectors_expr(parse_selector(self.selector))
+
     def get_selector(self):
-        sel = self.selector
-
-        sel = self.do_translations(sel)
-        sel = self.do_fixes(sel)
-        return sel
-
-    def do_translations(self, sel):
-        sel = self._translate_contains_word(sel)
-        sel = self._translate_endswith(sel)
-        sel = self._translate_contains_prefix(sel)
-        sel = self._translate_attrs(sel)
-        sel = self._translate_ids(sel)
-        sel = self._translate_classes(sel)
-        sel = self._translate_parents(sel)
-        return sel
-
-    def do_fixes(self, sel):
-        sel = self._fix_asterisks(sel)
-        sel = self._fix_bars(sel)
-        sel = self._fix_attrs(sel)
-        sel = self._fix_direct_childs(sel)
-        sel = self._fix_attr_startswith(sel)
-        sel = self._fix_attr_contains(sel)
-        sel = self._fix_attr_or(sel)
-        return sel
-
-    def _translate_contains_word(self, selector):
-        regex = re.compile(r'\[([^\s~]+)[~]="?([^\s"]+)"?\]')
-        sel = regex.sub("[@\g<1>='\g<2>' or contains(@\g<1>, '\g<2> ') or contains(@\g<1>, ' \g<2>')]", selector)
-        return sel
-
-    def _translate_endswith(self, selector):
-        regex = re.compile(r'\[([^\s$]+)[$]="?([^\s"]+)"?\]')
-        sel = regex.sub("[ends-with(@\g<1>, '\g<2>')]", selector)
-        return sel
-
-    def _translate_contains_prefix(self, selector):
-        regex = re.compile(r'\[([^\s|]+)[|]="?([^\s"]+)"?\]')
-        sel = regex.sub("[starts-with(@\g<1>, '\g<2>-')]", selector)
-        return sel
-
-    def _translate_attrs(self, selector):
-        regex = re.compile(r'\[(\S+)="?([^\s"]+)"?\]')
-        sel = regex.sub("[@\g<1>='\g<2>']", selector)
-        return sel
-
-    def _translate_ids(self, selector):
-        regex = re.compile(r'[#]([^ \[]+)')
-        return regex.sub("[@id='\g<1>']", selector)
-
-    def _translate_classes(self, selector):
-        regex = re.compile(r'[.]([^ .\[]+)')
-        sel = regex.sub("[contains(@class, '\g<1>')]", selector)
-        return sel
-
-    def _translate_parents(self, selector):
-        return "//%s" % ("//".join(selector.split()))
-
-    def _fix_asterisks(self, selector):
-        regex = re.compile(r'[/]{2}\[')
-        return regex.sub("//*[", selector)
-
-    def _fix_bars(self, selector):
-        return selector.replace("//'", "'")
-
-    def _fix_attrs(self, selector):
-        sel = selector.replace("][", " and ")
-        return sel
-
-    def _fix_direct_childs(self, selector):
-        sel = selector.replace("//>//", "/")
-        return sel
-
-    def _fix_attr_startswith(self, selector):
-        regex = re.compile(r"([@]\w+)\^\='(.*)'")
-        sel = regex.sub("starts-with(\g<1>, '\g<2>')", selector)
-        return sel
-
-    def _fix_attr_contains(self, selector):
-        regex = re.compile(r"([@]\w+)[*]='(.*)'")
-        sel = regex.sub("contains(\g<1>, '\g<2>')", selector)
-        return sel
-
-    def _fix_attr_or(self, selector):
-        return selector.replace('//or//', ' or ')
+        return str(self.expr)
 
     @property
     def path(self):
         return self.get_selector()
+
+# Compiled selectors shared by every Element, from CSS selector to the
+# Matcher or xpath.XPath expression selecting the same elements.
+selector_cache = xpath.LRUCache(512)
+
+def compile_selector(selector):
+    """Return the compiled form of a CSS selector: a Matcher when it can
+    be matched natively, or else the equivalent xpath.XPath expression,
+    compiled.  Both select elements with their find(node) method.
+
+    Selectors are parsed once, and then served from selector_cache for as
+    long as they stay in it.
+
+    """
+    try:
+        return selector_cache[selector]
+    except KeyError:
+        start = time.time()
+        selectors = parse_selector(selector)
+        if supported(selectors):
+            compiled = Matcher(selectors)
+        else:
+            compiled = xpath.XPath(selectors_expr(selectors)).compile()
+        selector_cache.add(selector, compiled, time.time() - start)
+        return compiled
@@ -0,0 +1,274 @@
+# #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# <dominic - python-pure implementation of CSS Selectors>
+# Copyright (C) <2010>  Gabriel Falcão <gabriel@nacaolivre.org>
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use,
+# copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+# OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+import re
+from xml.dom import Node
+
+from dominic import xpath
+
+ELEMENT_NODE = Node.ELEMENT_NODE
+WHITESPACE = re.compile(r'\s+')
+
+def supported(selectors):
+    """Return true if every parsed selector can be matched natively: only
+    descendant and child combinators, and no namespaced names."""
+    for selector in selectors:
+        for combinator, compound in selector.steps:
+            if combinator not in (None, ' ', '>'):
+                return False
+            names = [compound.tag] + [x[0] for x in compound.attributes]
+            for name in names:
+                if ':' in name:
+                    return False
+    return True
+
+def attribute_test(name, op, value):
+    """Return a function testing an attribute of an element the way the
+    equivalent XPath predicate does (see css.attribute_test)."""
+    if op is None:
+        return lambda node: node.hasAttribute(name)
+    elif op == '=':
+        return lambda node: (node.hasAttribute(name) and
+                             node.getAttribute(name) == value)
+    elif op == '~=':
+        padded = ' %s ' % value
+        return lambda node: padded in ' %s ' % WHITESPACE.sub(
+            ' ', node.getAttribute(name).strip())
+    elif op == '^=':
+        return lambda node: node.getAttribute(name).startswith(value)
+    elif op == '$=':
+        return lambda node: node.getAttribute(name).endswith(value)
+    elif op == '*=':
+        return lambda node: value in node.getAttribute(name)
+    elif op == '|=':
+        prefix = value + '-'
+        return lambda node: node.getAttribute(name).startswith(prefix)
+
+def tag_test(tag, namespace):
+    return lambda node: (node.localName == tag and
+                         node.namespaceURI == namespace)
+
+def compound_test(compound, namespace):
+    """Return a function telling whether an element matches a compound
+    selector.  Type selectors only match elements in 'namespace', the
+    default namespace of the document."""
+    tests = []
+    if compound.tag != '*':
+        tests.append(tag_test(compound.tag, namespace))
+    for id in compound.ids:
+        tests.append(attribute_test('id', '=', id))
+    for cls in compound.classes:
+        tests.append(attribute_test('class', '~=', cls))
+    for name, op, value in compound.attributes:
+        tests.append(attribute_test(name, op, value))
+
+    if len(tests) == 1:
+        return tests[0]
+    def test(node):
+        for t in tests:
+            if not t(node):
+                return False
+        return True
+    return test
+
+def combine(combinator, left, test):
+    """Return a function matching elements that pass 'test' and are
+    children (for '>') or descendants (for ' ') of an element matched by
+    'left'."""
+    if combinator == '>':
+        def match(node):
+            if not test(node):
+                return False
+            parent = node.parentNode
+            return (parent is not None and
+                    parent.nodeType == ELEMENT_NODE and left(parent))
+    else:
+        def match(node):
+            if not test(node):
+                return False
+            node = node.parentNode
+            while node is not None and node.nodeType == ELEMENT_NODE:
+                if left(node):
+                    return True
+                node = node.parentNode
+            return False
+    return match
+
+def selector_test(selector, namespace):
+    """Compile a parsed selector into a function matching elements from
+    right to left: the rightmost compound selector is tested first, then
+    the parents or ancestors required by each combinator."""
+    steps = selector.steps
+    match = compound_test(steps[0][1], namespace)
+    for combinator, compound in steps[1:]:
+        match = combine(combinator, match, compound_test(compound, namespace))
+    return match
+
+def elements(document):
+    """Yield every element of a document, in document order."""
+    stack = list(reversed(document.childNodes))
+    while stack:
+        node = stack.pop()
+        if node.nodeType == ELEMENT_NODE:
+            yield node
+            stack.extend(reversed(node.childNodes))
+
+def candidates(compound, index):
+    """Return the elements of an indexed document that may match the
+    rightmost compound selector, in document order, or None if it can't
+    be narrowed down through the index."""
+    if index is None:
+        return None
+    if compound.ids:
+        return index.by_id(compound.ids[0])
+    if compound.tag != '*':
+        return index.elements(compound.tag)
+    if compound.classes:
+        return index.by_class(compound.classes[0])
+    return None
+
+class Matcher(object):
+    """Selects the elements matching a group of parsed CSS selectors
+    without going through XPath evaluation.
+
+    Like the equivalent XPath expression, a Matcher selects elements from
+    the whole document of the node it is given.
+
+    """
+    def __init__(self, selectors):
+        self.selectors = selectors
+        # Compiled tests, by default namespace of the document.
+        self._tests = {}
+
+    def tests(self, namespace):
+        try:
+            return self._tests[namespace]
+        except KeyError:
+            tests = [selector_test(x, namespace) for x in self.selectors]
+            self._tests[namespace] = tests
+            return tests
+
+    def match(self, node, namespace=None):
+        """Return true if the element 'node' matches one of the selectors,
+        type selectors matching elements in the 'namespace' given."""
+        for test in self.tests(namespace):
+            if test(node):
+                return True
+        return False
+
+    def _search(self, node):
+        """Yield the candidates for each selector, with its test."""
+        if node.nodeType == node.DOCUMENT_NODE:
+            document = node
+        else:
+            document = node.ownerDocument
+        namespace = xpath.document_context(document).default_namespace
+        index = xpath.name_index(document, create=False)
+
+        for selector, test in zip(self.selectors, self.tests(namespace)):
+            nodes = candidates(selector.steps[-1][1], index)
+            if nodes is None:
+                nodes = elements(document)
+            yield nodes, test
+
+    def find(self, node):
+        """Return the matching elements of the document 'node' is part
+        of, in document order."""
+        results = [[n for n in nodes if test(n)]
+                   for nodes, test in self._search(node)]
+        return xpath.expr.merge_nodesets(results)
+
+    def first(self, node):
+        """Return the first matching element of the document 'node' is
+        part of, or None, without looking for the others."""
+        first = None
+        for nodes, test in self._search(node):
+            for n in nodes:
+                if test(n):
+                    if (first is None or xpath.expr.document_order(n) <
+                        xpath.expr.document_order(first)):
+                        first = n
+                    break
+        return first
+
+    def exists(self, node):
+        """Return true if any element of the document 'node' is part of
+        matches."""
+        return self.first(node) is not None
+
+    def __str__(self):
+        return ', '.join(str(x) for x in self.selectors)
+
+def find_many(node, matchers):
+    """Find the elements matching each of several Matchers with a single
+    traversal of the document 'node' is part of.
+
+    'matchers' maps names to Matchers.  Every element is only tested
+    against the selectors whose rightmost compound selector may match it,
+    looked up by its id, tag name and classes.  Returns a dict mapping
+    the same names to lists of elements in document order.
+
+    """
+    if node.nodeType == node.DOCUMENT_NODE:
+        document = node
+    else:
+        document = node.ownerDocument
+    namespace = xpath.document_context(document).default_namespace
+
+    # (results, test) pairs by the id, tag name or class the rightmost
+    # compound selector requires, or matching any element.
+    by_id = {}
+    by_tag = {}
+    by_class = {}
+    universal = []
+    results = {}
+    for name, matcher in matchers.iteritems():
+        found = results[name] = []
+        for selector, test in zip(matcher.selectors,
+                                  matcher.tests(namespace)):
+            compound = selector.steps[-1][1]
+            if compound.ids:
+                by_id.setdefault(compound.ids[0], []).append((found, test))
+            elif compound.tag != '*':
+                by_tag.setdefault(compound.tag, []).append((found, test))
+            elif compound.classes:
+                by_class.setdefault(compound.classes[0], []).append(
+                    (found, test))
+            else:
+                universal.append((found, test))
+
+    for element in elements(document):
+        buckets = [universal, by_tag.get(element.localName, ())]
+        if by_id:
+            buckets.append(by_id.get(element.getAttribute('id'), ()))
+        if by_class:
+            for token in element.getAttribute('class').split():
+                buckets.append(by_class.get(token, ()))
+        for bucket in buckets:
+            for found, test in bucket:
+                # A group of selectors may match the same element twice.
+                if (not found or found[-1] is not element) and test(element):
+                    found.append(element)
+    return results
@@ -1,10 +1,17 @@
+import time
 from xpath.exceptions import *
 import xpath.exceptions
 import xpath.expr
-import xpath.parser
+import xpath.pratt
+import xpath.scanner
 import xpath.yappsrt
+from xpath import expr
+from xpath.cache import LRUCache
+from xpath.expr import invalidate, name_index
 
-__all__ = ['find', 'findnode', 'findvalue', 'XPathContext', 'XPath']
+__all__ = ['find', 'findnode', 'findvalue', 'iterate', 'exists',
+           'XPathContext', 'XPath', 'LRUCache', 'document_context',
+           'invalidate', 'name_index']
 __all__.extend((x for x in dir(xpath.exceptions) if not x.startswith('_')))
 
 def api(f):
@@ -30,25 +37,35 @@ class XPathContext(object):
         self.default_namespace = None
         self.namespaces = {}
         self.variables = {}
+        # When memoize is true, each query evaluated with this context
+        # remembers the string-values of the elements it computes in
+        # string_values, so they aren't recomputed for every comparison.
+        self.memoize = False
+        self.string_values = None
 
         if document is not None:
-            if document.nodeType != document.DOCUMENT_NODE:
-                document = document.ownerDocument
-            if document.documentElement is not None:
-                attrs = document.documentElement.attributes
-                for attr in (attrs.item(i) for i in xrange(attrs.length)):
-                    if attr.name == 'xmlns':
-                        self.default_namespace = attr.value
-                    elif attr.name.startswith('xmlns:'):
-                        self.namespaces[attr.name[6:]] = attr.value
+            shared = document_context(document)
+            self.default_namespace = shared.default_namespace
+            self.namespaces.update(shared.namespaces)
 
         self.update(**kwargs)
 
+    def discover(self, document):
+        """Add the namespaces declared on the document element."""
+        if document.documentElement is not None:
+            attrs = document.documentElement.attributes
+            for attr in (attrs.item(i) for i in xrange(attrs.length)):
+                if attr.name == 'xmlns':
+                    self.default_namespace = attr.value
+                elif attr.name.startswith('xmlns:'):
+                    self.namespaces[attr.name[6:]] = attr.value
+
     def clone(self):
         dup = XPathContext()
         dup.default_namespace = self.default_namespace
         dup.namespaces.update(self.namespaces)
         dup.variables.update(self.variables)
+        dup.memoize = self.memoize
         return dup
 
     def update(self, default_namespace=None, namespaces=None,
@@ -77,49 +94,139 @@ class XPathContext(object):
     def findvalues(self, expr, node, **kwargs):
         return xpath.findvalues(expr, node, context=self, **kwargs)
 
+def document_context(node):
+    """Return the XPathContext with the namespaces declared by the
+    document 'node' is part of.
+
+    The context is built once per document and shared by all the queries
+    evaluated on it without a context of their own, so it must not be
+    modified.  invalidate() discards it.
+
+    """
+    if node.nodeType != node.DOCUMENT_NODE:
+        node = node.ownerDocument
+    context = getattr(node, '_xpath_context', None)
+    if context is None:
+        context = XPathContext()
+        context.discover(node)
+        node._xpath_context = context
+    return context
+
+def yapps_parse(string):
+    """Parse an expression string with the parser generated from
+    parser.g."""
+    import xpath.parser
+    return xpath.parser.XPath(xpath.scanner.XPathScanner(string)).XPath()
+
+# The parsers XPath() can parse expression strings with, by name.  Both
+# build the same expression trees; the yapps parser is the reference.
+parsers = {
+    'yapps': yapps_parse,
+    'pratt': xpath.pratt.parse,
+}
+
 class XPath():
-    _max_cache = 100
-    _cache = {}
+    # Expressions compiled by XPath.get(), with the time it took to parse
+    # them.  Its capacity can be changed through XPath.cache.capacity.
+    cache = LRUCache(100)
+
+    # The name of the parser in 'parsers' used by default.
+    parser = 'pratt'
+
+    def __init__(self, expr, parser=None):
+        """Compile an XPath expression.
+
+        'expr' is either the expression string, which gets parsed, or an
+        expression tree built out of xpath.expr classes.  'parser' names
+        the parser to parse it with, XPath.parser by default.
 
-    def __init__(self, expr):
-        """Init docs.
         """
-        try:
-            parser = xpath.parser.XPath(xpath.parser.XPathScanner(str(expr)))
-            self.expr = parser.XPath()
-        except xpath.yappsrt.SyntaxError, e:
-            raise XPathParseError(str(expr), e.pos, e.msg)
+        start = time.time()
+        if isinstance(expr, xpath.expr.Expr):
+            self.expr = expr
+        else:
+            parse = parsers[parser or self.parser]
+            try:
+                self.expr = parse(str(expr))
+            except xpath.yappsrt.SyntaxError, e:
+                raise XPathParseError(str(expr), e.pos, e.msg)
+        self.parse_time = time.time() - start
+        self.evaluate = self.expr.evaluate
+        self.compiled = False
 
     @classmethod
     def get(cls, s):
         if isinstance(s, cls):
             return s
         try:
-            return cls._cache[s]
+            return cls.cache[s]
         except KeyError:
-            if len(cls._cache) > cls._max_cache:
-                cls._cache.clear()
             expr = cls(s)
-            cls._cache[s] = expr
+            cls.cache.add(s, expr, expr.parse_time)
             return expr
 
-    @api
-    def find(self, node, context=None, **kwargs):
+    @classmethod
+    def prewarm(cls, expressions):
+        """Compile expressions ahead of time into the XPath.get() cache.
+
+        Returns the compiled expressions.
+
+        """
+        compiled = []
+        for s in expressions:
+            expr = cls(s)
+            cls.cache.add(s, expr, expr.parse_time)
+            compiled.append(expr)
+        return compiled
+
+    def compile(self):
+        """Compile the expression into Python closures, which evaluate it
+        without walking the expression tree, with the parts made of
+        constants computed once and for all.
+
+        Returns the XPath itself.
+
+        """
+        if not self.compiled:
+            self.evaluate = self.expr.compile()
+            self.compiled = True
+        return self
+
+    def query_context(self, node, context, kwargs):
+        """Return the context to evaluate a query with."""
         if context is None:
-            context = XPathContext(node, **kwargs)
-        elif kwargs:
+            context = document_context(node)
+        if kwargs:
             context = context.clone()
             context.update(**kwargs)
-        return self.expr.evaluate(node, 1, 1, context)
+        if context.memoize:
+            context = context.clone()
+            context.string_values = {}
+        return context
+
+    @api
+    def find(self, node, context=None, **kwargs):
+        context = self.query_context(node, context, kwargs)
+        return self.evaluate(node, 1, 1, context)
+
+    @api
+    def iterate(self, node, context=None, **kwargs):
+        """Return an iterator over the nodes selected by the expression,
+        in document order, which only evaluates as much of the
+        expression as it needs to find the next node."""
+        context = self.query_context(node, context, kwargs)
+        return self.expr.iterate(node, 1, 1, context)
 
     @api
     def findnode(self, node, context=None, **kwargs):
-        result = self.find(node, context, **kwargs)
-        if not xpath.expr.nodesetp(result):
-            raise XPathTypeError("expression is not a node-set")
-        if len(result) == 0:
-            return None
-        return result[0]
+        for result in self.iterate(node, context, **kwargs):
+            return result
+        return None
+
+    @api
+    def exists(self, node, context=None, **kwargs):
+        """Return true if the expression selects any node."""
+        return self.findnode(node, context, **kwargs) is not None
 
     @api
     def findvalue(self, node, context=None, **kwargs):
@@ -153,6 +260,14 @@ def find(expr, node, **kwargs):
 def findnode(expr, node, **kwargs):
     return XPath.get(expr).findnode(node, **kwargs)
 
+@api
+def iterate(expr, node, **kwargs):
+    return XPath.get(expr).iterate(node, **kwargs)
+
+@api
+def exists(expr, node, **kwargs):
+    return XPath.get(expr).exists(node, **kwargs)
+
 @api
 def findvalue(expr, node, **kwargs):
     return XPath.get(expr).findvalue(node, **kwargs)
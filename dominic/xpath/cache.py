@@ -0,0 +1,144 @@
+# The lock threading.Lock() returns, without importing threading.
+from thread import allocate_lock
+
+PREV, NEXT, KEY, VALUE, COST = 0, 1, 2, 3, 4
+
+class LRUCache(object):
+    """A mapping holding at most 'capacity' items.
+
+    When the cache is full, storing a new item evicts the least recently
+    used one.  Lookups through cache[key] count as a use of the item, and
+    are counted as hits or misses.  Items can be stored with the cost of
+    computing them (see add()), which is added to 'saved' on every hit.
+
+    The cache can be shared between threads.
+
+    """
+    def __init__(self, capacity=100):
+        self._capacity = capacity
+        self._links = {}
+        self._lock = allocate_lock()
+        # Circular doubly linked list of [prev, next, key, value, cost]
+        # links, from the least to the most recently used item.
+        self._root = root = []
+        root[:] = [root, root, None, None, 0]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved = 0
+
+    def _get_capacity(self):
+        return self._capacity
+
+    def _set_capacity(self, capacity):
+        with self._lock:
+            self._capacity = capacity
+            while len(self._links) > capacity:
+                self._evict()
+
+    capacity = property(_get_capacity, _set_capacity,
+                        doc="Maximum number of items held by the cache.")
+
+    def _unlink(self, link):
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+
+    def _append(self, link):
+        root = self._root
+        last = root[PREV]
+        link[PREV] = last
+        link[NEXT] = root
+        last[NEXT] = root[PREV] = link
+
+    def _evict(self):
+        link = self._root[NEXT]
+        self._unlink(link)
+        del self._links[link[KEY]]
+        self.evictions += 1
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                link = self._links[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.hits += 1
+            self.saved += link[COST]
+            self._unlink(link)
+            self._append(link)
+            return link[VALUE]
+
+    def __setitem__(self, key, value):
+        self.add(key, value)
+
+    def add(self, key, value, cost=0):
+        """Store an item, along with the cost of computing it."""
+        with self._lock:
+            link = self._links.get(key)
+            if link is not None:
+                link[VALUE] = value
+                link[COST] = cost
+                self._unlink(link)
+                self._append(link)
+                return
+            if self._capacity <= 0:
+                return
+            if len(self._links) >= self._capacity:
+                self._evict()
+            link = self._links[key] = [None, None, key, value, cost]
+            self._append(link)
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def __len__(self):
+        return len(self._links)
+
+    def keys(self):
+        """Return the keys, from the least to the most recently used."""
+        keys = []
+        with self._lock:
+            link = self._root[NEXT]
+            while link is not self._root:
+                keys.append(link[KEY])
+                link = link[NEXT]
+        return keys
+
+    def entries(self):
+        """Return the (key, value, cost) triples of the items, from the
+        least to the most recently used, without counting as a use."""
+        entries = []
+        with self._lock:
+            link = self._root[NEXT]
+            while link is not self._root:
+                entries.append((link[KEY], link[VALUE], link[COST]))
+                link = link[NEXT]
+        return entries
+
+    def clear(self):
+        """Remove every item and reset the statistics."""
+        with self._lock:
+            self._links.clear()
+            root = self._root
+            root[:] = [root, root, None, None, 0]
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.saved = 0
+
+    def stats(self):
+        """Return the cache statistics as a dict."""
+        return {
+            'size': len(self._links),
+            'capacity': self._capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'saved': self.saved,
+        }
+
+    def __repr__(self):
+        return '<%s: %d/%d items, %d hits, %d misses>' % (
+            self.__class__.__name__, len(self), self._capacity,
+            self.hits, self.misses)
@@ -0,0 +1,446 @@
+"""A compact, read-only document for XPath evaluation.
+
+xpath.expr doesn't depend on minidom: it walks trees through the subset
+of the DOM interfaces below, which minidom nodes provide as they are.
+Any other tree can be queried by providing it too.
+
+    Every node:
+        nodeType, the *_NODE node type constants, ownerDocument,
+        parentNode, firstChild, lastChild, previousSibling, nextSibling,
+        childNodes, attributes (None but for elements), and hashing by
+        identity.
+    Elements:
+        localName, namespaceURI, prefix, tagName, getAttribute(name),
+        hasAttribute(name), getAttributeNode(name), and attributes with
+        'length' and item(i).
+    Attributes:
+        localName, namespaceURI, prefix, name, value, ownerElement.
+    Text and comments:
+        data.
+    Processing instructions:
+        target, data.
+    Documents:
+        documentElement, getElementById(id).
+
+Elements and documents may also provide textContent, the concatenation of
+all their descendant text nodes, which is used as their string-value.
+Documents may hold a _xpath_document_order mapping from their nodes to
+their rank in document order, which is used instead of building one, and
+hold the _xpath_context and _xpath_name_index caches built on first use.
+
+CompactDocument keeps the whole tree in a few parallel arrays of
+integers, indexed by node number in document order, and creates node
+handles on demand: it takes a fraction of the memory of a minidom tree,
+and moving around it is integer arithmetic.
+
+"""
+from array import array
+from xml.parsers import expat
+
+ELEMENT_NODE = 1
+ATTRIBUTE_NODE = 2
+TEXT_NODE = 3
+PROCESSING_INSTRUCTION_NODE = 7
+COMMENT_NODE = 8
+DOCUMENT_NODE = 9
+
+XMLNS_NAMESPACE = 'http://www.w3.org/2000/xmlns/'
+
+# No node, in the link arrays.
+NONE = -1
+
+TEXT_NAME = (None, None, None, u'#text')
+COMMENT_NAME = (None, None, None, u'#comment')
+
+class NodeTypes(object):
+    __slots__ = ()
+    ELEMENT_NODE = ELEMENT_NODE
+    ATTRIBUTE_NODE = ATTRIBUTE_NODE
+    TEXT_NODE = TEXT_NODE
+    PROCESSING_INSTRUCTION_NODE = PROCESSING_INSTRUCTION_NODE
+    COMMENT_NODE = COMMENT_NODE
+    DOCUMENT_NODE = DOCUMENT_NODE
+
+class Attributes(object):
+    """The attributes of an element.
+
+    They are the nodes right after the element: their range is found
+    once, for length and item(i) to be constant time.
+
+    """
+
+    __slots__ = ('element', 'first', 'length')
+
+    def __init__(self, element):
+        self.element = element
+        kind = element._document.kind
+        self.first = i = element.index + 1
+        while i < len(kind) and kind[i] == ATTRIBUTE_NODE:
+            i += 1
+        self.length = i - self.first
+
+    def item(self, i):
+        if 0 <= i < self.length:
+            return self.element._document.node(self.first + i)
+        return None
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        node = self.element._document.node
+        return (node(i) for i in xrange(self.first, self.first + self.length))
+
+class Node(NodeTypes):
+    """Handle on a node of a CompactDocument."""
+
+    __slots__ = ('_document', 'index')
+
+    def __init__(self, document, index):
+        self._document = document
+        self.index = index
+
+    def _link(self, links):
+        i = links[self.index]
+        if i == NONE:
+            return None
+        return self._document.node(i)
+
+    @property
+    def ownerDocument(self):
+        return self._document
+
+    @property
+    def nodeType(self):
+        return self._document.kind[self.index]
+
+    @property
+    def parentNode(self):
+        if self.nodeType == ATTRIBUTE_NODE:
+            return None
+        return self._link(self._document.parent)
+
+    @property
+    def ownerElement(self):
+        if self.nodeType != ATTRIBUTE_NODE:
+            return None
+        return self._link(self._document.parent)
+
+    @property
+    def firstChild(self):
+        return self._link(self._document.first_child)
+
+    @property
+    def lastChild(self):
+        return self._link(self._document.last_child)
+
+    @property
+    def nextSibling(self):
+        return self._link(self._document.next_sibling)
+
+    @property
+    def previousSibling(self):
+        return self._link(self._document.previous_sibling)
+
+    @property
+    def childNodes(self):
+        document = self._document
+        next_sibling = document.next_sibling
+        children = []
+        i = document.first_child[self.index]
+        while i != NONE:
+            children.append(document.node(i))
+            i = next_sibling[i]
+        return children
+
+    @property
+    def attributes(self):
+        if self.nodeType == ELEMENT_NODE:
+            return Attributes(self)
+        return None
+
+    def _name(self):
+        return self._document.names[self._document.name_id[self.index]]
+
+    @property
+    def namespaceURI(self):
+        return self._name()[0]
+
+    @property
+    def localName(self):
+        return self._name()[1]
+
+    @property
+    def prefix(self):
+        return self._name()[2]
+
+    @property
+    def nodeName(self):
+        return self._name()[3]
+
+    tagName = name = target = nodeName
+
+    @property
+    def value(self):
+        return self._document.values[self._document.value_id[self.index]]
+
+    @property
+    def data(self):
+        document = self._document
+        if self.nodeType == TEXT_NODE:
+            return document.text_content(self.index)
+        return document.values[document.value_id[self.index]]
+
+    @property
+    def textContent(self):
+        return self._document.text_content(self.index)
+
+    def getAttributeNode(self, name):
+        document = self._document
+        kind = document.kind
+        names = document.names
+        name_id = document.name_id
+        i = self.index + 1
+        while i < len(kind) and kind[i] == ATTRIBUTE_NODE:
+            if names[name_id[i]][3] == name:
+                return document.node(i)
+            i += 1
+        return None
+
+    def getAttribute(self, name):
+        attr = self.getAttributeNode(name)
+        if attr is None:
+            return u''
+        return attr.value
+
+    def hasAttribute(self, name):
+        return self.getAttributeNode(name) is not None
+
+    def __repr__(self):
+        return '<%s %d: %s>' % (self.__class__.__name__, self.index,
+                                self.nodeName)
+
+class IndexOrder(object):
+    """Document order of the nodes of a CompactDocument, which is the
+    order they are numbered in."""
+
+    def __init__(self, document):
+        self.document = document
+
+    def __contains__(self, node):
+        return node._document is self.document
+
+    def __getitem__(self, node):
+        return node.index
+
+class CompactDocument(Node):
+    """A read-only document stored in parallel arrays.
+
+    Nodes are numbered in document order, the document itself being node
+    0, and each element being followed by its attributes.  For every
+    node, the arrays hold its type, its parent (or owner element), first
+    and last children, siblings, name, and value or the range of its text
+    in the document text.
+
+    """
+    __slots__ = ('kind', 'parent', 'first_child', 'last_child',
+                 'next_sibling', 'previous_sibling', 'name_id', 'value_id',
+                 'text_start', 'text_end', 'names', 'values', 'text',
+                 '_handles', '_xpath_document_order', '_xpath_name_index',
+                 '_xpath_context')
+
+    def __init__(self):
+        Node.__init__(self, self, 0)
+        self.kind = array('b', [DOCUMENT_NODE])
+        self.parent = array('i', [NONE])
+        self.first_child = array('i', [NONE])
+        self.last_child = array('i', [NONE])
+        self.next_sibling = array('i', [NONE])
+        self.previous_sibling = array('i', [NONE])
+        self.name_id = array('i', [0])
+        self.value_id = array('i', [NONE])
+        self.text_start = array('i', [0])
+        self.text_end = array('i', [0])
+        # (namespaceURI, localName, prefix, qualified name) tuples, and
+        # attribute, comment and processing instruction values.
+        self.names = [(None, None, None, u'#document')]
+        self.values = []
+        self.text = u''
+        self._handles = None
+        self._xpath_document_order = IndexOrder(self)
+        self._xpath_name_index = None
+        self._xpath_context = None
+
+    @classmethod
+    def fromstring(cls, string):
+        """Parse an XML document from a string."""
+        builder = Builder(cls())
+        return builder.parse(string)
+
+    @classmethod
+    def parse(cls, file):
+        """Parse an XML document from a file name or file object."""
+        if isinstance(file, basestring):
+            f = open(file, 'rb')
+            try:
+                return cls.fromstring(f.read())
+            finally:
+                f.close()
+        return cls.fromstring(file.read())
+
+    def node(self, index):
+        """Return the handle on a node, given its number."""
+        if index == 0:
+            return self
+        handle = self._handles[index]
+        if handle is None:
+            handle = self._handles[index] = Node(self, index)
+        return handle
+
+    def text_content(self, index):
+        return self.text[self.text_start[index]:self.text_end[index]]
+
+    @property
+    def nodeType(self):
+        return DOCUMENT_NODE
+
+    @property
+    def parentNode(self):
+        return None
+
+    @property
+    def ownerDocument(self):
+        return None
+
+    @property
+    def documentElement(self):
+        for node in self.childNodes:
+            if node.nodeType == ELEMENT_NODE:
+                return node
+        return None
+
+    def getElementById(self, id):
+        # Without a DTD, no attribute is of type ID (as with minidom).
+        return None
+
+    def __len__(self):
+        return len(self.kind)
+
+    def __repr__(self):
+        return '<%s: %d nodes>' % (self.__class__.__name__, len(self))
+
+class Builder(object):
+    """Fills a CompactDocument in from expat events."""
+
+    def __init__(self, document):
+        self.document = document
+        self.names = {}
+        self.text = []
+        self.length = 0
+        self.open = [0]
+        # The text node character data is being added to, if any.
+        self.last_text = None
+        self.namespaces = []
+
+    def parse(self, string):
+        parser = expat.ParserCreate(namespace_separator=' ')
+        parser.namespace_prefixes = True
+        parser.ordered_attributes = True
+        parser.buffer_text = True
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.StartNamespaceDeclHandler = self.start_namespace
+        parser.CharacterDataHandler = self.characters
+        parser.CommentHandler = self.comment
+        parser.ProcessingInstructionHandler = self.processing_instruction
+        parser.ExternalEntityRefHandler = lambda *args: 1
+        parser.Parse(string, True)
+
+        document = self.document
+        document.text = u''.join(self.text)
+        document.text_end[0] = self.length
+        document._handles = [None] * len(document.kind)
+        return document
+
+    def intern_name(self, name):
+        try:
+            return self.names[name]
+        except KeyError:
+            self.document.names.append(name)
+            i = self.names[name] = len(self.document.names) - 1
+            return i
+
+    def split(self, name):
+        parts = name.split(' ')
+        if len(parts) == 1:
+            return (None, name, None, name)
+        elif len(parts) == 2:
+            return (parts[0], parts[1], None, parts[1])
+        return (parts[0], parts[1], parts[2], '%s:%s' % (parts[2], parts[1]))
+
+    def add(self, kind, name, value=NONE, child=True):
+        document = self.document
+        i = len(document.kind)
+        parent = self.open[-1]
+        document.kind.append(kind)
+        document.parent.append(parent)
+        document.first_child.append(NONE)
+        document.last_child.append(NONE)
+        document.next_sibling.append(NONE)
+        document.previous_sibling.append(NONE)
+        document.name_id.append(self.intern_name(name))
+        document.value_id.append(value)
+        document.text_start.append(self.length)
+        document.text_end.append(self.length)
+        if child:
+            last = document.last_child[parent]
+            if last == NONE:
+                document.first_child[parent] = i
+            else:
+                document.next_sibling[last] = i
+                document.previous_sibling[i] = last
+            document.last_child[parent] = i
+        self.last_text = None
+        return i
+
+    def add_value(self, value):
+        self.document.values.append(value)
+        return len(self.document.values) - 1
+
+    def start_namespace(self, prefix, uri):
+        self.namespaces.append((prefix, uri))
+
+    def start_element(self, name, attributes):
+        i = self.add(ELEMENT_NODE, self.split(name))
+        self.open.append(i)
+        for prefix, uri in self.namespaces:
+            if prefix is None:
+                name = (XMLNS_NAMESPACE, u'xmlns', None, u'xmlns')
+            else:
+                name = (XMLNS_NAMESPACE, prefix, u'xmlns',
+                        u'xmlns:' + prefix)
+            self.add(ATTRIBUTE_NODE, name, self.add_value(uri or u''),
+                     child=False)
+        self.namespaces = []
+        for j in xrange(0, len(attributes), 2):
+            self.add(ATTRIBUTE_NODE, self.split(attributes[j]),
+                     self.add_value(attributes[j + 1]), child=False)
+
+    def end_element(self, name):
+        i = self.open.pop()
+        self.document.text_end[i] = self.length
+        self.last_text = None
+
+    def characters(self, data):
+        if self.last_text is None:
+            self.last_text = self.add(TEXT_NODE, TEXT_NAME)
+        self.text.append(data)
+        self.length += len(data)
+        self.document.text_end[self.last_text] = self.length
+
+    def comment(self, data):
+        self.add(COMMENT_NODE, COMMENT_NAME, self.add_value(data))
+
+    def processing_instruction(self, target, data):
+        self.add(PROCESSING_INSTRUCTION_NODE, (None, target, None, target),
+                 self.add_value(data))
@@ -1,5 +1,6 @@
 from __future__ import division
 from itertools import *
+import heapq
 import math
 import operator
 import re
@@ -9,20 +10,34 @@ import weakref
 from xpath.exceptions import *
 import xpath
 
+WHITESPACE = re.compile(r'\s+')
+
 
 #
 # Data model functions.
 #
 
-def string_value(node):
-    """Compute the string-value of a node."""
+def string_value(node, memo=None):
+    """Compute the string-value of a node.
+
+    'memo' is an optional dict remembering the string-values of elements
+    already computed, which is only valid as long as the document isn't
+    modified.  Computing the string-value of an element through it also
+    fills in those of its descendant elements.
+
+    """
     if (node.nodeType == node.DOCUMENT_NODE or
         node.nodeType == node.ELEMENT_NODE):
-        s = u''
-        for n in axes['descendant'](node):
-            if n.nodeType == n.TEXT_NODE:
-                s += n.data
-        return s
+        text = getattr(node, 'textContent', None)
+        if text is not None:
+            return text
+        if memo is not None:
+            value = memo.get(node)
+            if value is None:
+                value = memo_string_value(node, memo)
+            return value
+        return u''.join([n.data for n in axes['descendant'](node)
+                         if n.nodeType == n.TEXT_NODE])
 
     elif node.nodeType == node.ATTRIBUTE_NODE:
         return node.value
@@ -32,42 +47,239 @@ def string_value(node):
           node.nodeType == node.TEXT_NODE):
         return node.data
 
-def document_order(node):
-    """Compute a document order value for the node.
+def memo_string_value(node, memo):
+    """Compute the string-value of an element or document from those of
+    its children, storing it and those of all its descendant elements
+    in 'memo'."""
+    TEXT_NODE = node.TEXT_NODE
+    ELEMENT_NODE = node.ELEMENT_NODE
+    # Stack of the elements being computed, with an iterator over their
+    # remaining children and the string-values of those already visited.
+    stack = [(node, iter(node.childNodes), [])]
+    while stack:
+        parent, children, parts = stack[-1]
+        for child in children:
+            if child.nodeType == TEXT_NODE:
+                parts.append(child.data)
+            elif child.nodeType == ELEMENT_NODE:
+                value = memo.get(child)
+                if value is None:
+                    stack.append((child, iter(child.childNodes), []))
+                    break
+                parts.append(value)
+        else:
+            stack.pop()
+            value = memo[parent] = u''.join(parts)
+            if stack:
+                stack[-1][2].append(value)
+    return memo[node]
+
+def preorder(root):
+    """Yield the nodes of the tree rooted at 'root' in document order,
+    attributes included: right after their element and before its
+    children, in the order the attribute axis returns them."""
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        if node.nodeType == node.ELEMENT_NODE:
+            attrs = node.attributes
+            for i in xrange(attrs.length):
+                yield attrs.item(i)
+        if node.nodeType != node.ATTRIBUTE_NODE:
+            stack.extend(reversed(node.childNodes))
 
-    cmp(document_order(a), document_order(b)) will return -1, 0, or 1 if
-    a is before, identical to, or after b in the document respectively.
+class DocumentOrder(object):
+    """Document order ranks for all the nodes of a tree.
 
-    We represent document order as a list of sibling indexes.  That is,
-    the third child of the document node has an order of [2].  The first
-    child of that node has an order of [2,0].
+    The ranks are assigned by a single pre-order traversal of the tree
+    rooted at 'root': every node gets a rank one higher than the node
+    visited before it.
 
-    Attributes have a sibling index of -1 (coming before all children of
-    their node) and are further ordered by name--e.g., [2,0,-1,'href'].
+    Once given, a rank never changes, for the ranks looked up during a
+    query all to be comparable: nodes added to the tree afterwards are
+    ranked by update(), between the nodes around them.
 
     """
+    def __init__(self, root):
+        self.root = root
+        self.ranks = dict(izip(preorder(root), count()))
 
-    # Attributes: parent-order + [-1, attribute-name]
-    if node.nodeType == node.ATTRIBUTE_NODE:
-        order = document_order(node.ownerElement)
-        order.extend((-1, node.name))
-        return order
+    def update(self):
+        """Rank the nodes added to the tree since it was ranked, and
+        forget those removed from it.
 
-    # The document root (hopefully): []
-    if node.parentNode is None:
-        return []
+        The nodes added between two ranked nodes get fractional ranks
+        evenly spaced between theirs, leaving the other ranks as they
+        are.  Nodes moved within the tree keep their old rank, which is
+        why moving nodes requires invalidate(), as the methods of
+        dominic.Element modifying the tree do.  This walks the whole
+        tree, however few nodes were added.
+
+        """
+        ranks = self.ranks
+        kept = {}
+        added = []
+        previous = None
+        for node in preorder(self.root):
+            rank = ranks.get(node)
+            if rank is None:
+                added.append(node)
+                continue
+            if added:
+                self._rank_between(kept, added, previous, rank)
+                added = []
+            kept[node] = previous = rank
+        if added:
+            self._rank_between(kept, added, previous, None)
+        # Updated in place, for ranker() to go on looking them up.
+        ranks.clear()
+        ranks.update(kept)
+
+    def _rank_between(self, ranks, nodes, low, high):
+        # Imported here, as it imports decimal, for modified trees only.
+        from fractions import Fraction
+        if high is None:
+            step = Fraction(1)
+        else:
+            step = Fraction(high - low) / (len(nodes) + 1)
+        for i, node in enumerate(nodes):
+            ranks[node] = low + step * (i + 1)
+
+    def __contains__(self, node):
+        return node in self.ranks
+
+    def __getitem__(self, node):
+        return self.ranks[node]
+
+def tree_root(node):
+    """Return the root node of the tree containing 'node'."""
+    if (node.nodeType == node.ATTRIBUTE_NODE and
+        node.ownerElement is not None):
+        node = node.ownerElement
+    while node.parentNode is not None:
+        node = node.parentNode
+    return node
+
+def order_index(root):
+    """Return the DocumentOrder of the tree rooted at 'root', building it
+    if this tree has not been indexed yet."""
+    index = getattr(root, '_xpath_document_order', None)
+    if index is None:
+        index = DocumentOrder(root)
+        root._xpath_document_order = index
+    return index
+
+def invalidate(node):
+    """Discard the indexes of the tree containing 'node'.
+
+    This must be called whenever an indexed tree is modified: the ranks
+    of moved nodes are no longer valid, a NameIndex does not know about
+    added nodes either, and the namespace declarations of the document
+    element may have changed.  (Nodes only added to a tree without a
+    NameIndex are ranked by document_order() without invalidation, in
+    between the nodes already ranked.)
+
+    """
+    for root in (node.ownerDocument, tree_root(node)):
+        if getattr(root, '_xpath_document_order', None) is not None:
+            root._xpath_document_order = None
+        if getattr(root, '_xpath_context', None) is not None:
+            root._xpath_context = None
+        if getattr(root, '_xpath_name_index', None) is not None:
+            root._xpath_name_index.clear()
+
+class NameIndex(object):
+    """Elements of a document indexed by local name, id and class.
+
+    Each entry is a list of elements in document order.  The index is
+    built on first use, by a single traversal of the document, and built
+    again on the first use following a clear().
+
+    """
+    def __init__(self, document):
+        self.document = document
+        self.clear()
+
+    def clear(self):
+        self._names = None
+        self._ids = None
+        self._classes = None
+
+    def build(self):
+        self._names = names = {}
+        self._ids = ids = {}
+        self._classes = classes = {}
+        stack = list(reversed(self.document.childNodes))
+        while stack:
+            node = stack.pop()
+            if node.nodeType != node.ELEMENT_NODE:
+                continue
+            names.setdefault(node.localName, []).append(node)
+            id = node.getAttribute('id')
+            if id:
+                ids.setdefault(id, []).append(node)
+            for token in node.getAttribute('class').split():
+                classes.setdefault(token, []).append(node)
+            stack.extend(reversed(node.childNodes))
+
+    def elements(self, localName):
+        """Return the elements with the given local name."""
+        if self._names is None:
+            self.build()
+        return self._names.get(localName, [])
+
+    def by_id(self, id):
+        """Return the elements with the given id attribute."""
+        if self._ids is None:
+            self.build()
+        return self._ids.get(id, [])
+
+    def by_class(self, token):
+        """Return the elements with 'token' in their class attribute."""
+        if self._classes is None:
+            self.build()
+        return self._classes.get(token, [])
+
+def name_index(document, create=True):
+    """Return the NameIndex of a document, attaching one to it first if
+    needed and 'create' is true (otherwise None is returned).
+
+    Paths evaluated from the root of a document with a NameIndex look
+    elements up in it instead of walking the tree, so the document must
+    be invalidate()d whenever it is modified afterwards.
+
+    """
+    index = getattr(document, '_xpath_name_index', None)
+    if index is None and create:
+        index = document._xpath_name_index = NameIndex(document)
+    return index
+
+def document_order(node):
+    """Compute a document order value for the node.
 
-    # Determine which child this is of its parent.
-    sibpos = 0
-    sib = node
-    while sib.previousSibling is not None:
-        sibpos += 1
-        sib = sib.previousSibling
+    cmp(document_order(a), document_order(b)) will return -1, 0, or 1 if
+    a is before, identical to, or after b in the document respectively.
 
-    # Order: parent-order + [sibling-position]
-    order = document_order(node.parentNode)
-    order.append(sibpos)
-    return order
+    We represent document order as a rank, looked up in the
+    DocumentOrder index of the node's document.  The index is built on
+    first use and reused by every later query, so this is a single dict
+    lookup for indexed nodes.  Ranks are only comparable within a tree.
+
+    """
+    document = node.ownerDocument
+    if document is not None:
+        index = order_index(document)
+        if node in index:
+            return index[node]
+
+    # The node was added after the index was built, or it belongs to a
+    # tree that isn't (yet) attached to its owner document.
+    root = tree_root(node)
+    index = order_index(root)
+    if node not in index:
+        index.update()
+    return index[node]
 
 #
 # Type functions, operating on the various XPath types.
@@ -90,12 +302,12 @@ def nodesetp(v):
     if isinstance(v, list):
         return True
 
-def string(v):
+def string(v, memo=None):
     """Convert a value to a string."""
     if nodesetp(v):
         if not v:
             return u''
-        return string_value(v[0])
+        return string_value(v[0], memo)
     elif numberp(v):
         if v == float('inf'):
             return u'Infinity'
@@ -144,8 +356,42 @@ def numberp(v):
     return (not(isinstance(v, bool)) and
             (isinstance(v, int) or isinstance(v, float)))
 
+#
+# Compilation.
+#
+# Expr.compile() returns a function of (node, pos, size, context) computing
+# the value Expr.evaluate() would.  The functions of constant expressions
+# hold that value in their 'value' attribute, so that expressions made of
+# constants are computed once, when compiled.
+#
+
+def constant(value):
+    """Return the compiled form of an expression whose value is 'value'."""
+    f = lambda node, pos, size, context: value
+    f.value = value
+    return f
+
+def constantp(f):
+    """Return true iff 'f' is the compiled form of a constant expression."""
+    return hasattr(f, 'value')
+
+def fold(f):
+    """Return the compiled form of a constant expression, given a function
+    computing its value without using its context.  Expressions raising
+    an error are left to raise it when evaluated."""
+    try:
+        return constant(f(None, 1, 1, None))
+    except XPathError:
+        return f
+
 class Expr(object):
-    """Abstract base class for XPath expressions."""
+    """Abstract base class for XPath expressions.
+
+    Expressions can be pickled.  Those holding functions, or what
+    compile() and evaluation cache, are pickled as the arguments they
+    were built with, and built again when unpickled.
+
+    """
 
     def evaluate(self, node, pos, size, context):
         """Evaluate the expression.
@@ -157,6 +403,28 @@ class Expr(object):
 
         """
 
+    def iterate(self, node, pos, size, context):
+        """Evaluate a node-set expression lazily.
+
+        Returns an iterator over the nodes of the node-set, in document
+        order.  Expressions which can't be evaluated lazily compute the
+        whole node-set first.
+
+        """
+        return iter(nodeset(self.evaluate(node, pos, size, context)))
+
+    def compile(self):
+        """Compile the expression into a function of the same arguments as
+        evaluate(), returning the same value.
+
+        The predicates of the location paths within the expression are
+        compiled in place, and used by evaluate() from then on.
+
+        """
+        for expr in subexpressions(self):
+            expr.compile()
+        return self.evaluate
+
 class BinaryOperatorExpr(Expr):
     """Base class for all binary operators."""
 
@@ -170,6 +438,15 @@ class BinaryOperatorExpr(Expr):
         return self.operate(self.left.evaluate(node, pos, size, context),
                             self.right.evaluate(node, pos, size, context))
 
+    def compile(self):
+        left, right = self.left.compile(), self.right.compile()
+        operate = self.operate
+        f = lambda node, pos, size, context: operate(
+            left(node, pos, size, context), right(node, pos, size, context))
+        if constantp(left) and constantp(right):
+            return fold(f)
+        return f
+
     def __str__(self):
         return '(%s %s %s)' % (self.left, self.op, self.right)
 
@@ -181,6 +458,15 @@ class AndExpr(BinaryOperatorExpr):
         return (boolean(self.left.evaluate(node, pos, size, context) and
                 boolean(self.right.evaluate(node, pos, size, context))))
 
+    def compile(self):
+        left, right = self.left.compile(), self.right.compile()
+        f = lambda node, pos, size, context: boolean(
+            left(node, pos, size, context) and
+            boolean(right(node, pos, size, context)))
+        if constantp(left) and constantp(right):
+            return fold(f)
+        return f
+
 class OrExpr(BinaryOperatorExpr):
     """<x> or <y>"""
 
@@ -189,6 +475,15 @@ class OrExpr(BinaryOperatorExpr):
         return (boolean(self.left.evaluate(node, pos, size, context) or
                 boolean(self.right.evaluate(node, pos, size, context))))
 
+    def compile(self):
+        left, right = self.left.compile(), self.right.compile()
+        f = lambda node, pos, size, context: boolean(
+            left(node, pos, size, context) or
+            boolean(right(node, pos, size, context)))
+        if constantp(left) and constantp(right):
+            return fold(f)
+        return f
+
 class EqualityExpr(BinaryOperatorExpr):
     """<x> = <y>, <x> != <y>, etc."""
 
@@ -201,16 +496,58 @@ class EqualityExpr(BinaryOperatorExpr):
         '>'  : operator.gt,
     }
 
-    def operate(self, a, b):
+    def evaluate(self, node, pos, size, context):
+        return self.operate(self.left.evaluate(node, pos, size, context),
+                            self.right.evaluate(node, pos, size, context),
+                            context.string_values)
+
+    def compile(self):
+        left, right = self.left.compile(), self.right.compile()
+        operate = self.operate
+        if constantp(left) and constantp(right):
+            return constant(operate(left.value, right.value))
+        if constantp(left) and self.op in ('=', '!='):
+            left, right = right, left
+        if not constantp(right) or not (stringp(right.value) or
+                                        numberp(right.value)):
+            return lambda node, pos, size, context: operate(
+                left(node, pos, size, context),
+                right(node, pos, size, context), context.string_values)
+
+        # Comparing a node-set with a constant string or number, as in
+        # [@id = 'x']: the string-value of each node is only converted as
+        # the constant requires.
+        value = right.value
+        if self.op not in ('=', '!=') or numberp(value):
+            convert = number
+            value = number(value)
+        else:
+            convert = None
+        compare = self.operators[self.op]
+        def f(node, pos, size, context):
+            a = left(node, pos, size, context)
+            if not nodesetp(a):
+                return operate(a, value, context.string_values)
+            memo = context.string_values
+            for n in a:
+                v = string_value(n, memo)
+                if convert is not None:
+                    v = convert(v)
+                if compare(v, value):
+                    return True
+            return False
+        return f
+
+    def operate(self, a, b, memo=None):
         if nodesetp(a):
             for node in a:
-                if self.operate(string_value(node), b):
+                if self.operate(string_value(node, memo), b):
                     return True
             return False
 
         if nodesetp(b):
             for node in b:
-                if self.operate(a, string_value(node)):
+                if self.operate(a, string_value(node, memo)):
                     return True
             return False
 
@@ -252,6 +589,16 @@ class ArithmeticalExpr(BinaryOperatorExpr):
     def operate(self, a, b):
         return self.operators[self.op](number(a), number(b))
 
+    def compile(self):
+        left, right = self.left.compile(), self.right.compile()
+        op = self.operators[self.op]
+        f = lambda node, pos, size, context: op(
+            number(left(node, pos, size, context)),
+            number(right(node, pos, size, context)))
+        if constantp(left) and constantp(right):
+            return fold(f)
+        return f
+
 class UnionExpr(BinaryOperatorExpr):
     """<x> | <y>"""
 
@@ -259,8 +606,14 @@ class UnionExpr(BinaryOperatorExpr):
         if not nodesetp(a) or not nodesetp(b):
             raise XPathTypeError("union operand is not a node-set")
 
-        # Need to sort the result to preserve document order.
-        return sorted(set(chain(a, b)), key=document_order)
+        return merge_nodesets((a, b))
+
+    def iterate(self, node, pos, size, context):
+        # Numbered like the operands of merge_nodesets(), for nodes of
+        # different trees ranked alike to come in the same order.
+        operands = [ranked(x.iterate(node, pos, size, context), i)
+                    for i, x in enumerate((self.left, self.right))]
+        return unique((rank, n) for rank, i, n in heapq.merge(*operands))
 
 class NegationExpr(Expr):
     """- <x>"""
@@ -271,6 +624,14 @@ class NegationExpr(Expr):
     def evaluate(self, node, pos, size, context):
         return -number(self.expr.evaluate(node, pos, size, context))
 
+    def compile(self):
+        expr = self.expr.compile()
+        f = lambda node, pos, size, context: -number(
+            expr(node, pos, size, context))
+        if constantp(expr):
+            return fold(f)
+        return f
+
     def __str__(self):
         return '(-%s)' % self.expr
 
@@ -283,6 +644,9 @@ class LiteralExpr(Expr):
     def evaluate(self, node, pos, size, context):
         return self.literal
 
+    def compile(self):
+        return constant(self.literal)
+
     def __str__(self):
         if stringp(self.literal):
             if "'" in self.literal:
@@ -333,6 +697,9 @@ class Function(Expr):
             len(self.args) > self.evaluate.maxargs):
             raise XPathTypeError, 'too many arguments for "%s()"' % name
 
+    def __reduce__(self):
+        return (Function, (self.name, self.args))
+
     #
     # XPath functions are implemented by methods of the Function class.
     #
@@ -364,12 +731,18 @@ class Function(Expr):
                         args[0] = args[0][0]
                     else:
                         args[0] = None
-                if convert is not None:
+                if convert is string:
+                    args = [string(x, context.string_values) for x in args]
+                elif convert is not None:
                     args = [convert(x) for x in args]
                 return f(self, node, pos, size, context, *args)
 
             new_f.minargs = minargs
             new_f.maxargs = maxargs
+            new_f.implicit = implicit
+            new_f.first = first
+            new_f.convert = convert
+            new_f.implementation = f
             new_f.__name__ = f.__name__
             new_f.__doc__ = f.__doc__
             return new_f
@@ -392,12 +765,13 @@ class Function(Expr):
     @function(1, 1)
     def f_id(self, node, pos, size, context, arg):
         if nodesetp(arg):
-            ids = (string_value(x) for x in arg)
+            ids = (string_value(x, context.string_values) for x in arg)
         else:
             ids = [string(arg)]
         if node.nodeType != node.DOCUMENT_NODE:
             node = node.ownerDocument
-        return list(filter(None, (node.getElementById(id) for id in ids)))
+        return sort_nodeset(filter(None, (node.getElementById(id)
+                                          for id in ids)))
 
     @function(0, 1, implicit=True, first=True)
     def f_local_name(self, node, pos, size, context, argnode):
@@ -496,7 +870,7 @@ class Function(Expr):
 
     @function(0, 1, implicit=True, convert=string)
     def f_normalize_space(self, node, pos, size, context, s):
-        return re.sub(r'\s+', ' ', s.strip())
+        return WHITESPACE.sub(' ', s.strip())
 
     @function(3, 3, convert=lambda x: unicode(string(x)))
     def f_translate(self, node, pos, size, context, s, source, target):
@@ -551,7 +925,8 @@ class Function(Expr):
 
     @function(1, 1, convert=nodeset)
     def f_sum(self, node, pos, size, context, nodes):
-        return sum((number(string_value(x)) for x in nodes))
+        memo = context.string_values
+        return sum((number(string_value(x, memo)) for x in nodes))
 
     @function(1, 1, convert=number)
     def f_floor(self, node, pos, size, context, n):
@@ -567,9 +942,68 @@ class Function(Expr):
         # XXX round(-1.5) should be -1.0, not -2.0.
         return round(n)
 
+    def compile(self):
+        wrapper = self.evaluate
+        args = [x.compile() for x in self.args]
+        if wrapper.implicit and not args:
+            args = [lambda node, pos, size, context: [node]]
+        if wrapper.first:
+            args[0] = compile_first(args[0])
+        if wrapper.convert is not None:
+            args = [compile_convert(x, wrapper.convert) for x in args]
+
+        f = wrapper.implementation
+        if not args:
+            call = lambda node, pos, size, context: f(self, node, pos, size,
+                                                      context)
+        elif len(args) == 1:
+            a, = args
+            call = lambda node, pos, size, context: f(
+                self, node, pos, size, context,
+                a(node, pos, size, context))
+        elif len(args) == 2:
+            a, b = args
+            call = lambda node, pos, size, context: f(
+                self, node, pos, size, context,
+                a(node, pos, size, context), b(node, pos, size, context))
+        else:
+            call = lambda node, pos, size, context: f(
+                self, node, pos, size, context,
+                *[x(node, pos, size, context) for x in args])
+
+        if (self.name not in context_functions and
+            all(constantp(x) for x in args)):
+            return fold(call)
+        return call
+
     def __str__(self):
         return '%s(%s)' % (self.name, ', '.join((str(x) for x in self.args)))
 
+# Functions whose value depends on the context even with constant
+# arguments.
+context_functions = frozenset(('last', 'position', 'id', 'local-name',
+                               'namespace-uri', 'name', 'lang'))
+
+def compile_first(arg):
+    """Compile the argument of a function taking the first node of a
+    node-set."""
+    def f(node, pos, size, context):
+        nodes = nodeset(arg(node, pos, size, context))
+        if len(nodes) > 0:
+            return nodes[0]
+        return None
+    return f
+
+def compile_convert(arg, convert):
+    """Compile a function argument converted by 'convert'."""
+    if constantp(arg):
+        return fold(lambda node, pos, size, context: convert(arg.value))
+    if convert is string:
+        return lambda node, pos, size, context: string(
+            arg(node, pos, size, context), context.string_values)
+    return lambda node, pos, size, context: convert(
+        arg(node, pos, size, context))
+
 #
 # XPath axes.
 #
@@ -598,11 +1032,24 @@ def make_axes():
     def child(node):
         return node.childNodes
 
+    # The descendant, following and preceding axes walk the tree through
+    # firstChild/nextSibling/parentNode links, without any recursion: the
+    # cost of yielding a node doesn't depend on its depth.
+
     @axisfn()
     def descendant(node):
-        for child in node.childNodes:
-            for node in descendant_or_self(child):
-                yield node
+        root = node
+        node = node.firstChild
+        while node is not None:
+            yield node
+            if node.firstChild is not None:
+                node = node.firstChild
+                continue
+            while node.nextSibling is None:
+                node = node.parentNode
+                if node is root or node is None:
+                    return
+            node = node.nextSibling
 
     @axisfn()
     def parent(node):
@@ -630,21 +1077,33 @@ def make_axes():
     @axisfn()
     def following(node):
         while node is not None:
-            while node.nextSibling is not None:
-                node = node.nextSibling
-                for n in descendant_or_self(node):
-                    yield n
-            node = node.parentNode
+            if node.nextSibling is None:
+                node = node.parentNode
+                continue
+            node = node.nextSibling
+            for n in descendant_or_self(node):
+                yield n
 
     @axisfn(reverse=True)
     def preceding(node):
         while node is not None:
-            while node.previousSibling is not None:
-                node = node.previousSibling
-                # Could be more efficient here.
-                for n in reversed(list(descendant_or_self(node))):
-                    yield n
-            node = node.parentNode
+            if node.previousSibling is None:
+                node = node.parentNode
+                continue
+            sibling = node = node.previousSibling
+            # Walk the subtree of the sibling in reverse document order,
+            # starting from its last descendant.
+            while node.lastChild is not None:
+                node = node.lastChild
+            while node is not sibling:
+                yield node
+                if node.previousSibling is not None:
+                    node = node.previousSibling
+                    while node.lastChild is not None:
+                        node = node.lastChild
+                else:
+                    node = node.parentNode
+            yield sibling
 
     @axisfn(principal_node_type=xml.dom.Node.ATTRIBUTE_NODE)
     def attribute(node):
@@ -664,9 +1123,8 @@ def make_axes():
     @axisfn()
     def descendant_or_self(node):
         yield node
-        for child in node.childNodes:
-            for node in descendant_or_self(child):
-                yield node
+        for n in descendant(node):
+            yield n
 
     @axisfn(reverse=True)
     def ancestor_or_self(node):
@@ -678,30 +1136,307 @@ def make_axes():
 
 make_axes()
 
-def merge_into_nodeset(target, source):
-    """Place all the nodes from the source node-set into the target
-    node-set, preserving document order.  Both node-sets must be in
+def merge_nodesets(nodesets):
+    """Merge a sequence of node-sets into a single node-set, preserving
+    document order and dropping duplicates.  Every node-set must be in
     document order to begin with.
 
+    When each node-set starts after the previous one ends (the common
+    case for child and attribute steps) the node-sets are concatenated.
+    Otherwise they are combined with a k-way merge on document order
+    ranks, which is also how duplicates are recognized.
+
     """
-    if len(target) == 0:
-        target.extend(source)
-        return
+    runs = [ns for ns in nodesets if len(ns) > 0]
+    if len(runs) == 0:
+        return []
+    if len(runs) == 1:
+        return list(runs[0])
+
+    last = document_order(runs[0][-1])
+    for run in runs[1:]:
+        if document_order(run[0]) <= last:
+            break
+        last = document_order(run[-1])
+    else:
+        return list(chain(*runs))
 
-    source = [n for n in source if n not in target]
-    if len(source) == 0:
-        return
+    decorated = [[(document_order(n), i, n) for n in run]
+                 for i, run in enumerate(runs)]
+    return list(unique((rank, n) for rank, i, n in heapq.merge(*decorated)))
+
+def unique(ranked):
+    """Yield the nodes of an iterator over (rank, node) pairs in document
+    order, dropping duplicates.
 
-    # If the last node in the target set comes before the first node in the
-    # source set, then we can just concatenate the sets.  Otherwise, we
-    # will need to sort.  (We could also check to see if the last node in
-    # the source set comes before the first node in the target set, but this
-    # situation is very unlikely in practice.)
-    if document_order(target[-1]) < document_order(source[0]):
-        target.extend(source)
+    The nodes of a tree all have different ranks, so a node ranked like
+    the one before it is the same node, unless it belongs to another
+    tree, ranked apart.
+
+    """
+    last = None
+    same = []
+    for rank, n in ranked:
+        if rank != last:
+            yield n
+            last = rank
+            same = [n]
+        elif n not in same:
+            yield n
+            same.append(n)
+
+def ranked(nodes, i=0):
+    """Yield (rank, i, node) for each node of an iterator."""
+    for n in nodes:
+        yield document_order(n), i, n
+
+# Axes along which every node comes at or after the context node in
+# document order (which the parent axis, though not a reverse axis, breaks).
+bounded_axes = frozenset(('child', 'descendant', 'descendant-or-self',
+                          'following', 'following-sibling', 'attribute',
+                          'self', 'namespace'))
+
+def bounded(step):
+    """Return true if every node 'step' selects comes at or after its
+    context node in document order, and in document order itself: that
+    is, if it is a step along one of the bounded_axes."""
+    if isinstance(step, PredicateList):
+        if step.axis.reverse:
+            return False
+        step = unwrap(step.expr)
+    return (isinstance(step, AxisStep) and
+            step.axis.__name__ in bounded_axes)
+
+def ranker(node):
+    """Return a function computing document_order() for the nodes of the
+    document 'node' is part of, which looks most of them up directly in
+    the document's DocumentOrder."""
+    if node.nodeType == node.DOCUMENT_NODE:
+        document = node
     else:
-        target.extend(source)
-        target.sort(key=document_order)
+        document = node.ownerDocument
+    ranks = None
+    if document is not None:
+        ranks = getattr(order_index(document), 'ranks', None)
+    if ranks is None:
+        return document_order
+    get = ranks.get
+    def rank(n):
+        r = get(n)
+        if r is None:
+            return document_order(n)
+        return r
+    return rank
+
+def stream_step(contexts, step, context):
+    """Evaluate a bounded() step lazily for each node of an iterator over
+    context nodes in document order.
+
+    Nothing selected from a context node can come before the next context
+    node, so the nodes selected before it are yielded right away; only
+    the ones coming after it are kept, in a heap, to be merged with what
+    the following context nodes select.
+
+    """
+    return unique(stream_ranked(contexts, step, context))
+
+def stream_ranked(contexts, step, context):
+    """Yield (rank, node) for the nodes stream_step() selects, in document
+    order, duplicates included."""
+    contexts = iter(contexts)
+    current = next(contexts, None)
+    if current is None:
+        return
+    rank = ranker(current)
+
+    # (rank, serial, node, iterator) for the next node selected from each
+    # context node whose selection has been put off.
+    pending = []
+    serial = count()
+    while current is not None:
+        following = next(contexts, None)
+        if following is None:
+            bound = None
+        else:
+            bound = rank(following)
+
+        nodes = step.iterate(current, 1, 1, context)
+        for n in nodes:
+            r = rank(n)
+            if bound is not None and r >= bound:
+                heapq.heappush(pending, (r, next(serial), n, nodes))
+                break
+            while pending and pending[0][0] < r:
+                pr, _, pn, pnodes = heapq.heappop(pending)
+                yield pr, pn
+                for pn in pnodes:
+                    heapq.heappush(pending, (rank(pn), next(serial), pn,
+                                             pnodes))
+                    break
+            yield r, n
+
+        while pending and (bound is None or pending[0][0] < bound):
+            pr, _, pn, pnodes = heapq.heappop(pending)
+            yield pr, pn
+            for pn in pnodes:
+                heapq.heappush(pending, (rank(pn), next(serial), pn, pnodes))
+                break
+        current = following
+
+def fuse_steps(steps):
+    """Return the steps of a path, with each descendant-or-self::node()
+    step followed by a child step without positional predicates turned
+    into the equivalent descendant step."""
+    fused = []
+    i = 0
+    while i < len(steps):
+        step = steps[i]
+        if (i + 1 < len(steps) and isinstance(step, AxisStep) and
+            step.axis is axes['descendant-or-self'] and
+            isinstance(step.test, AnyKindTest)):
+            child = steps[i + 1]
+            predicates = None
+            if isinstance(child, PredicateList):
+                predicates = child.predicates
+                child = unwrap(child.expr)
+                if any(positional(x) for x in predicates):
+                    child = None
+            if (isinstance(child, AxisStep) and
+                child.axis is axes['child']):
+                step = AxisStep('descendant', child.test)
+                if predicates is not None:
+                    evaluators = steps[i + 1].evaluators
+                    step = PredicateList(step, predicates, 'descendant')
+                    step.evaluators = evaluators
+                i += 1
+        fused.append(step)
+        i += 1
+    return fused
+
+def sort_nodeset(nodes):
+    """Return the nodes as a node-set: in document order, without
+    duplicates."""
+    return sorted(set(nodes), key=document_order)
+
+# Functions returning a number, which selects nodes by position when used
+# as a predicate.
+numeric_functions = frozenset(('last', 'position', 'count', 'string-length',
+                               'number', 'sum', 'floor', 'ceiling', 'round'))
+
+def subexpressions(expr):
+    """Return the expressions directly contained in 'expr'."""
+    if isinstance(expr, BinaryOperatorExpr):
+        return [expr.left, expr.right]
+    elif isinstance(expr, NegationExpr):
+        return [expr.expr]
+    elif isinstance(expr, Function):
+        return expr.args
+    elif isinstance(expr, PathExpr):
+        return expr.steps
+    elif isinstance(expr, AbsolutePathExpr):
+        return filter(None, [expr.path])
+    elif isinstance(expr, PredicateList):
+        return [expr.expr] + expr.predicates
+    return []
+
+def unwrap(expr):
+    """Return the step of a single-step path, which has the same value
+    as the path itself; other expressions are returned unchanged."""
+    while isinstance(expr, PathExpr) and len(expr.steps) == 1:
+        expr = expr.steps[0]
+    return expr
+
+def positional(expr):
+    """Return true if the value of 'expr' as a predicate may depend on the
+    context position or size: that is, if it can evaluate to a number or
+    calls position() or last().
+
+    """
+    expr = unwrap(expr)
+    if isinstance(expr, LiteralExpr):
+        if numberp(expr.literal):
+            return True
+    elif isinstance(expr, (ArithmeticalExpr, NegationExpr,
+                           VariableReference)):
+        return True
+    elif isinstance(expr, Function) and expr.name in numeric_functions:
+        return True
+
+    stack = [expr]
+    while stack:
+        expr = stack.pop()
+        if isinstance(expr, Function) and expr.name in ('position', 'last'):
+            return True
+        stack.extend(subexpressions(expr))
+    return False
+
+def id_literal(expr):
+    """Return the value 'x' if 'expr' is the predicate @id = 'x'."""
+    if not isinstance(expr, EqualityExpr) or expr.op != '=':
+        return None
+    for attr, literal in ((expr.left, expr.right), (expr.right, expr.left)):
+        attr, literal = unwrap(attr), unwrap(literal)
+        if (isinstance(attr, AxisStep) and
+            attr.axis is axes['attribute'] and
+            isinstance(attr.test, NameTest) and
+            attr.test.prefix is None and attr.test.localName == 'id' and
+            isinstance(literal, LiteralExpr) and
+            stringp(literal.literal) and literal.literal):
+            return literal.literal
+    return None
+
+def indexed_descendants(document, first, second, context):
+    """Evaluate the steps descendant-or-self::node()/<second> from the
+    document node through the document's NameIndex.
+
+    This is possible when <second> is a child step with a name test,
+    optionally followed by predicates that don't depend on the context
+    position.  Elements are looked up by id when one of the predicates
+    is @id = 'x', and by their local name otherwise.  Returns None when
+    the steps can't be evaluated this way.
+
+    """
+    index = getattr(document, '_xpath_name_index', None)
+    if (index is None or not isinstance(first, AxisStep) or
+        first.axis is not axes['descendant-or-self'] or
+        not isinstance(first.test, AnyKindTest)):
+        return None
+
+    predicates = evaluators = []
+    if isinstance(second, PredicateList):
+        predicates = second.predicates
+        evaluators = second.evaluators
+        second = second.expr
+        for pred in predicates:
+            if positional(pred):
+                return None
+    if (not isinstance(second, AxisStep) or
+        second.axis is not axes['child'] or
+        not isinstance(second.test, NameTest)):
+        return None
+
+    candidates = None
+    for pred in predicates:
+        id = id_literal(pred)
+        if id is not None:
+            candidates = index.by_id(id)
+            break
+    if candidates is None:
+        if second.test.localName == '*':
+            return None
+        candidates = index.elements(second.test.localName)
+
+    result = []
+    test = second.test.matcher(second.axis, context)
+    for node in candidates:
+        if not test(node):
+            continue
+        for pred in evaluators:
+            if not boolean(pred(node, 1, 1, context)):
+                break
+        else:
+            result.append(node)
+    return result
 
 class AbsolutePathExpr(Expr):
     """Absolute location paths."""
@@ -716,6 +1451,13 @@ class AbsolutePathExpr(Expr):
             return [node]
         return self.path.evaluate(node, 1, 1, context)
 
+    def iterate(self, node, pos, size, context):
+        if node.nodeType != node.DOCUMENT_NODE:
+            node = node.ownerDocument
+        if self.path is None:
+            return iter([node])
+        return self.path.iterate(node, 1, 1, context)
+
     def __str__(self):
         return '/%s' % (self.path or '')
 
@@ -724,28 +1466,69 @@ class PathExpr(Expr):
 
     def __init__(self, steps):
         self.steps = steps
+        self._fused = {}
+
+    def __reduce__(self):
+        return (PathExpr, (self.steps,))
+
+    def fused(self, start):
+        """Return the steps following the first 'start' ones, fused by
+        fuse_steps()."""
+        try:
+            return self._fused[start]
+        except KeyError:
+            steps = self._fused[start] = fuse_steps(self.steps[start:])
+            return steps
 
     def evaluate(self, node, pos, size, context):
         # The first step in the path is evaluated in the current context.
         # If this is the only step in the path, the return value is
         # unimportant.  If there are other steps, however, it must be a
         # node-set.
-        result = self.steps[0].evaluate(node, pos, size, context)
-        if len(self.steps) > 1 and not nodesetp(result):
-            raise XPathTypeError("path step is not a node-set")
-
-        # Subsequent steps are evaluated for each node in the node-set
-        # resulting from the previous step.
-        for step in self.steps[1:]:
-            aggregate = []
-            for i in xrange(len(result)):
-                nodes = step.evaluate(result[i], i+1, len(result), context)
-                if not nodesetp(nodes):
-                    raise XPathTypeError("path step is not a node-set")
-                merge_into_nodeset(aggregate, nodes)
-            result = aggregate
-
-        return result
+        if len(self.steps) == 1:
+            return self.steps[0].evaluate(node, pos, size, context)
+        return list(self.iterate(node, pos, size, context))
+
+    def compile(self):
+        steps = [x.compile() for x in self.steps]
+        # Steps fused before now hold the predicates uncompiled.
+        self._fused = {}
+        if len(steps) == 1:
+            return steps[0]
+        return self.evaluate
+
+    def evaluate_step(self, step, result, context):
+        aggregate = []
+        for i in xrange(len(result)):
+            nodes = step.evaluate(result[i], i+1, len(result), context)
+            if not nodesetp(nodes):
+                raise XPathTypeError("path step is not a node-set")
+            aggregate.append(nodes)
+        return merge_nodesets(aggregate)
+
+    def iterate(self, node, pos, size, context):
+        steps = self.steps
+        result = None
+        if node.nodeType == node.DOCUMENT_NODE and len(steps) > 1:
+            result = indexed_descendants(node, steps[0], steps[1], context)
+
+        if result is not None:
+            nodes = iter(result)
+            steps = self.fused(2)
+        else:
+            nodes = steps[0].iterate(node, pos, size, context)
+            steps = self.fused(1)
+
+        # Each step consumes the nodes selected by the previous one as
+        # they come.  Steps along forward axes are streamed; any other
+        # step needs the whole node-set of the previous step, for its
+        # positions.
+        for step in steps:
+            if bounded(step):
+                nodes = stream_step(nodes, step, context)
+            else:
+                nodes = iter(self.evaluate_step(step, list(nodes), context))
+        return nodes
 
     def __str__(self):
         return '/'.join((str(s) for s in self.steps))
@@ -761,6 +1544,14 @@ class PredicateList(Expr):
         self.predicates = predicates
         self.expr = expr
         self.axis = axes[axis]
+        # The functions evaluating each predicate, compiled by compile().
+        self.evaluators = [x.evaluate for x in predicates]
+        # Whether any predicate needs the position of the nodes.
+        self.by_position = any(positional(x) for x in predicates)
+
+    def __reduce__(self):
+        return (PredicateList, (self.expr, self.predicates,
+                                self.axis.__name__))
 
     def evaluate(self, node, pos, size, context):
         result = self.expr.evaluate(node, pos, size, context)
@@ -770,10 +1561,10 @@ class PredicateList(Expr):
         if self.axis.reverse:
             result.reverse()
 
-        for pred in self.predicates:
+        for pred in self.evaluators:
             match = []
             for i, node in izip(count(1), result):
-                r = pred.evaluate(node, i, len(result), context)
+                r = pred(node, i, len(result), context)
 
                 # If a predicate evaluates to a number, select the node
                 # with that position.  Otherwise, select nodes for which
@@ -790,6 +1581,27 @@ class PredicateList(Expr):
 
         return result
 
+    def iterate(self, node, pos, size, context):
+        # Positional predicates need the whole node-set, for its size.
+        if self.axis.reverse or self.by_position:
+            return Expr.iterate(self, node, pos, size, context)
+        return self.filter(self.expr.iterate(node, pos, size, context),
+                           context)
+
+    def filter(self, nodes, context):
+        predicates = self.evaluators
+        for n in nodes:
+            for pred in predicates:
+                if not boolean(pred(n, 1, 1, context)):
+                    break
+            else:
+                yield n
+
+    def compile(self):
+        self.expr.compile()
+        self.evaluators = [x.compile() for x in self.predicates]
+        return self.evaluate
+
     def __str__(self):
         s = str(self.expr)
         if '/' in s:
@@ -805,17 +1617,49 @@ class AxisStep(Expr):
         self.axis = axes[axis]
         self.test = test
 
+    def __reduce__(self):
+        return (AxisStep, (self.axis.__name__, self.test))
+
     def evaluate(self, node, pos, size, context):
-        match = []
-        for n in self.axis(node):
-            if self.test.match(n, self.axis, context):
-                match.append(n)
+        test = self.test.matcher(self.axis, context)
+        if test is None:
+            match = list(self.axis(node))
+        else:
+            match = [n for n in self.axis(node) if test(n)]
 
         if self.axis.reverse:
             match.reverse()
 
         return match
 
+    def iterate(self, node, pos, size, context):
+        if self.axis.reverse:
+            return iter(self.evaluate(node, pos, size, context))
+        return self.select(node, context)
+
+    def compile(self):
+        test = self.test
+        if (self.axis is axes['attribute'] and isinstance(test, NameTest) and
+            test.prefix is None and test.localName != '*'):
+            # attribute::name selects at most one attribute, which is
+            # looked up by name instead of going through all of them.
+            name = test._name
+            def f(node, pos, size, context):
+                if node.nodeType != node.ELEMENT_NODE:
+                    return []
+                attr = node.getAttributeNode(name)
+                if attr is None or attr.namespaceURI is not None:
+                    return []
+                return [attr]
+            return f
+        return self.evaluate
+
+    def select(self, node, context):
+        test = self.test.matcher(self.axis, context)
+        if test is None:
+            return iter(self.axis(node))
+        return (n for n in self.axis(node) if test(n))
+
     def __str__(self):
         return '%s::%s' % (self.axis.__name__, self.test)
 
@@ -829,12 +1673,39 @@ class Test(object):
     def match(self, node, axis, context):
         """Return True if 'node' matches the test along 'axis'."""
 
-class NameTest(object):
+    def matcher(self, axis, context):
+        """Return a function of a node equivalent to match() along 'axis'
+        in 'context', for testing many nodes, or None if every node
+        matches.
+
+        Raises XPathUnknownPrefixError when the test uses a prefix
+        'context' doesn't declare.
+
+        """
+        match = self.match
+        return lambda node: match(node, axis, context)
+
+def unicode_name(name):
+    """Return a name as unicode, which DOM names are, so that comparing
+    them doesn't convert it again for every node."""
+    if isinstance(name, str):
+        try:
+            return name.decode('ascii')
+        except UnicodeDecodeError:
+            pass
+    return name
+
+class NameTest(Test):
     def __init__(self, prefix, localpart):
         self.prefix = prefix
         self.localName = localpart
         if self.prefix == None and self.localName == '*':
             self.prefix = '*'
+        self._name = unicode_name(localpart)
+        self._matchers = {}
+
+    def __reduce__(self):
+        return (NameTest, (self.prefix, self.localName))
 
     def match(self, node, axis, context):
         if node.nodeType != axis.principal_node_type:
@@ -856,13 +1727,61 @@ class NameTest(object):
                 return False
         return True
 
+    def matcher(self, axis, context):
+        node_type = axis.principal_node_type
+        namespaceURI = None
+        if self.prefix == '*':
+            pass
+        elif self.prefix is not None:
+            try:
+                namespaceURI = context.namespaces[self.prefix]
+            except KeyError:
+                raise XPathUnknownPrefixError(self.prefix)
+        elif node_type == xml.dom.Node.ELEMENT_NODE:
+            namespaceURI = context.default_namespace
+
+        # Resolving the namespace is all there is to do per context node:
+        # the matchers only depend on it and on the node type.
+        key = (node_type, namespaceURI)
+        try:
+            return self._matchers[key]
+        except KeyError:
+            match = self._matchers[key] = self.bind(node_type, namespaceURI)
+            return match
+
+    def bind(self, node_type, namespaceURI):
+        """Return a function matching the nodes of type 'node_type', and
+        in 'namespaceURI' unless the test has a wildcard prefix."""
+        name = self._name
+        if self.prefix == '*':
+            if name == '*':
+                return lambda node: node.nodeType == node_type
+            return lambda node: (node.nodeType == node_type and
+                                 node.localName == name)
+        if name == '*':
+            return lambda node: (node.nodeType == node_type and
+                                 node.namespaceURI == namespaceURI)
+        if namespaceURI is None:
+            return lambda node: (node.nodeType == node_type and
+                                 node.localName == name and
+                                 node.namespaceURI is None)
+        return lambda node: (node.nodeType == node_type and
+                             node.localName == name and
+                             node.namespaceURI == namespaceURI)
+
     def __str__(self):
         if self.prefix is not None:
             return '%s:%s' % (self.prefix, self.localName)
         else:
             return self.localName
 
-class PITest(object):
+def is_comment(node):
+    return node.nodeType == xml.dom.Node.COMMENT_NODE
+
+def is_text(node):
+    return node.nodeType == xml.dom.Node.TEXT_NODE
+
+class PITest(Test):
     def __init__(self, name=None):
         self.name = name
 
@@ -879,23 +1798,32 @@ class PITest(object):
             name = "'%s'" % self.name
         return 'processing-instruction(%s)' % name
 
-class CommentTest(object):
+class CommentTest(Test):
     def match(self, node, axis, context):
         return node.nodeType == node.COMMENT_NODE
 
+    def matcher(self, axis, context):
+        return is_comment
+
     def __str__(self):
         return 'comment()'
 
-class TextTest(object):
+class TextTest(Test):
     def match(self, node, axis, context):
         return node.nodeType == node.TEXT_NODE
 
+    def matcher(self, axis, context):
+        return is_text
+
     def __str__(self):
         return 'text()'
 
-class AnyKindTest(object):
+class AnyKindTest(Test):
     def match(self, node, axis, context):
         return True
 
+    def matcher(self, axis, context):
+        return None
+
     def __str__(self):
         return 'node()'
@@ -0,0 +1,277 @@
+"""An operator precedence parser for XPath expressions.
+
+The yapps parser generated from parser.g goes down one rule for each
+level of precedence (or, and, equality, ...) for every operand, peeking
+at the next token at each level.  XPathParser parses binary operators by
+their binding power instead, as a Pratt (top down operator precedence)
+parser, and the rest of the grammar by recursive descent.
+
+It builds the same expression trees as the yapps parser, out of the
+tokens of the same scanner.  Where the scanner needs to know which
+tokens may come next to tell them apart (NCNAME, FUNCNAME, axis names and
+operator names, '*' and '-'), it asks for tokens with the same
+restrictions as the generated parser, so that the input is tokenized the
+same way.  parser.g remains the reference grammar.
+
+"""
+import xpath.expr as X
+from xpath.scanner import XPathScanner
+from xpath.yappsrt import SyntaxError
+
+# Token types, as the scanner names them.
+END = 'END'
+FORWARD_AXIS_NAME = 'FORWARD_AXIS_NAME'
+REVERSE_AXIS_NAME = 'REVERSE_AXIS_NAME'
+NCNAME = 'NCNAME'
+FUNCNAME = 'FUNCNAME'
+DQUOTE = 'DQUOTE'
+SQUOTE = 'SQUOTE'
+NUMBER = 'NUMBER'
+EQ_COMP = 'EQ_COMP'
+REL_COMP = 'REL_COMP'
+ADD_COMP = 'ADD_COMP'
+MUL_COMP = 'MUL_COMP'
+QNAME_COLON = "r'\\:'"
+NODE = "r'node'"
+TEXT = "r'text'"
+COMMENT = "r'comment'"
+PI = "r'processing-instruction'"
+COMMA = "r'\\,'"
+DOT = "r'\\.'"
+DOLLAR = "r'\\$'"
+RPAREN = "r'\\)'"
+LPAREN = "r'\\('"
+RBRACKET = "r'\\]'"
+LBRACKET = "r'\\['"
+STAR = "r'\\*'"
+COLON = "r':'"
+DOTDOT = "r'\\.\\.'"
+AT = "r'@'"
+AXIS = "r'::'"
+DSLASH = "r'\\/\\/'"
+SLASH = "r'\\/'"
+MINUS = "r'\\-'"
+UNION = "'\\|'"
+AND = "r'and'"
+OR = "r'or'"
+
+# The tokens which may start a step, and those which may follow a
+# complete operand.
+FIRST_STEP = (LPAREN, FORWARD_AXIS_NAME, AT, REVERSE_AXIS_NAME, DOTDOT,
+              DOLLAR, DOT, FUNCNAME, NUMBER, DQUOTE, SQUOTE, PI, COMMENT,
+              TEXT, NODE, STAR, NCNAME)
+FOLLOW = (UNION, MUL_COMP, ADD_COMP, REL_COMP, EQ_COMP, AND, OR, END,
+          RBRACKET, RPAREN, COMMA)
+
+PATH = (SLASH, DSLASH) + FIRST_STEP
+OPERAND = (MINUS,) + PATH
+# After '/', which may or may not be followed by a relative path.
+ROOT = FIRST_STEP + FOLLOW
+OPERATOR = (LBRACKET, SLASH, DSLASH) + FOLLOW
+NAME_OPERATOR = (COLON,) + OPERATOR
+QNAME_OPERATOR = (QNAME_COLON,) + OPERATOR
+NODE_TEST = (PI, COMMENT, TEXT, NODE, STAR, NCNAME)
+NAME = (STAR, NCNAME)
+ARGUMENTS = (COMMA, RPAREN) + OPERAND
+PI_ARGUMENT = (NCNAME, DQUOTE, SQUOTE, RPAREN)
+
+# The binding power of each binary operator, and the class of its
+# expressions.
+operators = {
+    OR: (1, X.OrExpr),
+    AND: (2, X.AndExpr),
+    EQ_COMP: (3, X.EqualityExpr),
+    REL_COMP: (4, X.EqualityExpr),
+    ADD_COMP: (5, X.ArithmeticalExpr),
+    MUL_COMP: (6, X.ArithmeticalExpr),
+    UNION: (7, X.UnionExpr),
+}
+
+kind_tests = {
+    COMMENT: X.CommentTest,
+    TEXT: X.TextTest,
+    NODE: X.AnyKindTest,
+}
+
+class XPathParser(object):
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.pos = 0
+
+    def peek(self, restrict):
+        """Return the next token, scanned with 'restrict'."""
+        return self.scanner.token(self.pos, restrict)
+
+    def scan(self, type):
+        """Return the text of the next token, which must be of 'type', and
+        move past it."""
+        token = self.scanner.token(self.pos, (type,))
+        if token[2] != type:
+            raise SyntaxError(token[0], 'Trying to find ' + type)
+        self.pos += 1
+        return token[3]
+
+    def parse(self):
+        expr = self.expr()
+        self.scan(END)
+        return expr
+
+    def expr(self, power=0):
+        """Parse an expression made of operators binding tighter than
+        'power'."""
+        left = self.unary()
+        while 1:
+            token = self.peek(FOLLOW)
+            try:
+                binding, cls = operators[token[2]]
+            except KeyError:
+                return left
+            if binding <= power:
+                return left
+            self.pos += 1
+            left = cls(token[3], left, self.expr(binding))
+
+    def unary(self):
+        if self.peek(OPERAND)[2] == MINUS:
+            self.pos += 1
+            return X.NegationExpr(self.path())
+        return self.path()
+
+    def path(self):
+        type = self.peek(PATH)[2]
+        if type == SLASH:
+            self.pos += 1
+            if self.peek(ROOT)[2] in FOLLOW:
+                return X.AbsolutePathExpr(None)
+            return X.AbsolutePathExpr(self.relative())
+        elif type == DSLASH:
+            self.pos += 1
+            path = self.relative()
+            path.steps.insert(0, X.AxisStep('descendant-or-self'))
+            return X.AbsolutePathExpr(path)
+        return self.relative()
+
+    def relative(self):
+        steps = [self.step()]
+        while 1:
+            type = self.peek(OPERATOR)[2]
+            if type == SLASH:
+                self.pos += 1
+            elif type == DSLASH:
+                self.pos += 1
+                steps.append(X.AxisStep('descendant-or-self'))
+            else:
+                return X.PathExpr(steps)
+            steps.append(self.step())
+
+    def step(self):
+        token = self.peek(FIRST_STEP)
+        type = token[2]
+        if type == FORWARD_AXIS_NAME or type == REVERSE_AXIS_NAME:
+            self.pos += 1
+            self.scan(AXIS)
+            axis, test = token[3], self.node_test()
+        elif type == AT:
+            self.pos += 1
+            axis, test = 'attribute', self.node_test()
+        elif type == DOTDOT:
+            self.pos += 1
+            axis, test = 'parent', None
+        elif type in NODE_TEST:
+            axis, test = 'child', self.node_test()
+        else:
+            return self.filter()
+
+        expr = X.AxisStep(axis, test)
+        if self.peek(OPERATOR)[2] == LBRACKET:
+            expr = X.PredicateList(expr, self.predicates(), axis)
+        return expr
+
+    def node_test(self):
+        type = self.peek(NODE_TEST)[2]
+        if type == PI:
+            self.pos += 1
+            self.scan(LPAREN)
+            name = None
+            token = self.peek(PI_ARGUMENT)
+            if token[2] == NCNAME:
+                self.pos += 1
+                name = token[3]
+            elif token[2] == DQUOTE or token[2] == SQUOTE:
+                self.pos += 1
+                name = token[3][1:-1]
+            self.scan(RPAREN)
+            return X.PITest(name)
+        elif type in kind_tests:
+            self.pos += 1
+            self.scan(LPAREN)
+            self.scan(RPAREN)
+            return kind_tests[type]()
+
+        prefix = None
+        localpart = self.name()
+        if self.peek(NAME_OPERATOR)[2] == COLON:
+            self.pos += 1
+            prefix = localpart
+            localpart = self.name()
+        return X.NameTest(prefix, localpart)
+
+    def name(self):
+        if self.peek(NAME)[2] == STAR:
+            self.pos += 1
+            return '*'
+        return self.scan(NCNAME)
+
+    def filter(self):
+        token = self.peek(FIRST_STEP)
+        type = token[2]
+        self.pos += 1
+        if type == NUMBER:
+            expr = X.LiteralExpr(float(token[3]))
+        elif type == DQUOTE or type == SQUOTE:
+            expr = X.LiteralExpr(token[3][1:-1])
+        elif type == DOLLAR:
+            name = self.scan(NCNAME)
+            if self.peek(QNAME_OPERATOR)[2] == QNAME_COLON:
+                self.pos += 1
+                expr = X.VariableReference(name, self.scan(NCNAME))
+            else:
+                expr = X.VariableReference(None, name)
+        elif type == LPAREN:
+            expr = self.expr()
+            self.scan(RPAREN)
+        elif type == DOT:
+            expr = X.AxisStep('self')
+        elif type == FUNCNAME:
+            self.scan(LPAREN)
+            args = []
+            if self.peek(ARGUMENTS)[2] not in (COMMA, RPAREN):
+                args.append(self.expr())
+                while self.peek((COMMA, RPAREN))[2] == COMMA:
+                    self.pos += 1
+                    args.append(self.expr())
+            self.scan(RPAREN)
+            expr = X.Function(token[3], args)
+        else:
+            raise SyntaxError(token[0],
+                              'Trying to find one of ' + ', '.join(FIRST_STEP))
+
+        if self.peek(OPERATOR)[2] == LBRACKET:
+            expr = X.PredicateList(expr, self.predicates())
+        return expr
+
+    def predicates(self):
+        predicates = []
+        while self.peek(OPERATOR)[2] == LBRACKET:
+            self.pos += 1
+            predicates.append(self.expr())
+            self.scan(RBRACKET)
+        return predicates
+
+def parse(string):
+    """Parse an expression string into an expression tree.
+
+    Raises xpath.yappsrt.SyntaxError, as the yapps parser does.
+
+    """
+    return XPathParser(XPathScanner(string)).parse()
@@ -0,0 +1,99 @@
+"""A faster scanner for the XPath parser.
+
+The yapps scanner tries every token pattern allowed at the current
+position, one regular expression after the other, to find the longest
+match.  XPathScanner does the same in a single regular expression: each
+pattern is wrapped in a lookahead capturing what it matches, and those
+are tried in turn by the regular expression engine, with one such
+expression built for each set of tokens the parser asks for.  It yields
+the very same tokens, the longest match winning and the first pattern
+listed winning ties, but keeps all the matching out of Python code.
+
+The patterns are those of the scanner generated from parser.g, which
+compiles them all when it is defined: xpath.parser is only imported, and
+the combined expressions only built, as they are first needed.
+
+"""
+import re
+
+from xpath.yappsrt import NoMoreTokens, Scanner, SyntaxError
+
+class XPathScanner(Scanner):
+    # (regex, [(token, group)], allowed tokens) for each restriction the
+    # parser scans tokens with, shared by all the scanners.
+    combined = {}
+
+    def __init__(self, input):
+        Scanner.__init__(self, None, ['\\s+'], input)
+
+    @property
+    def patterns(self):
+        import xpath.parser
+        return xpath.parser.XPathScanner.patterns
+
+    def token(self, i, restrict=0):
+        if i == len(self.tokens):
+            self.scan(restrict)
+        if i < len(self.tokens):
+            # Tokens scanned ahead must have been scanned with a
+            # restriction allowing all of the ones now asked for.
+            allowed = self.restrictions[i]
+            if restrict and allowed and not allowed.issuperset(restrict):
+                raise NotImplementedError(
+                    "Unimplemented: restriction set changed")
+            return self.tokens[i]
+        raise NoMoreTokens()
+
+    def combine(self, restrict):
+        """Return the regular expression trying the patterns allowed by
+        'restrict' at once, with the group capturing the match of each
+        pattern."""
+        parts = []
+        groups = []
+        group = 1
+        for name, regex in self.patterns:
+            if restrict and name not in restrict and name not in self.ignore:
+                continue
+            parts.append('(?:(?=(%s))|)' % regex.pattern)
+            groups.append((name, group))
+            group += 1 + regex.groups
+        combined = self.combined[restrict] = (re.compile(''.join(parts)),
+                                              groups, frozenset(restrict))
+        return combined
+
+    def scan(self, restrict):
+        restrict = tuple(restrict or ())
+        try:
+            regex, groups, allowed = self.combined[restrict]
+        except KeyError:
+            regex, groups, allowed = self.combine(restrict)
+
+        input = self.input
+        while 1:
+            spans = regex.match(input, self.pos).regs
+            best_end = self.pos - 1
+            best_pat = None
+            for name, group in groups:
+                end = spans[group][1]
+                if end > best_end:
+                    best_pat = name
+                    best_end = end
+            best_match = best_end - self.pos
+
+            if best_pat is None:
+                msg = "Bad Token"
+                if restrict:
+                    msg = "Trying to find one of " + ", ".join(restrict)
+                raise SyntaxError(self.pos, msg)
+
+            if best_pat not in self.ignore:
+                token = (self.pos, self.pos + best_match, best_pat,
+                         input[self.pos:self.pos + best_match])
+                self.pos += best_match
+                # As with yapps, a token identical to the last one isn't
+                # added again.
+                if not self.tokens or token != self.tokens[-1]:
+                    self.tokens.append(token)
+                    self.restrictions.append(allowed)
+                return
+            self.pos += best_match
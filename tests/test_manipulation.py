@@ -25,7 +25,7 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 from sure import that
 from tests.base import with_fixture
-from dominic import DOM, Element
+from dominic import DOM, Element, parse_stats, reset_parse_stats
 
 @with_fixture("divs.html")
 def text_return_the_text_within_element(context):
@@ -202,3 +202,42 @@ def error_tolerance_for_non_well_formed_html(context):
 
     assert that(p.text()).equals("Paragraph")
 
+
+@with_fixture("divs.html")
+def html_keeps_document_order_for_later_queries(context):
+    "Element().html('new html') keeps later queries in document order"
+    dom = DOM(context.html)
+
+    assert that(dom.find("li").first().attr("id")).equals("ball")
+
+    dom.find("#ball").first().html('<li id="bat">to hit</li>')
+    dom.find("#puppet").first().html('<li id="robot">to build</li>')
+
+    elements = dom.find("ul#objects > li")
+    assert that(elements).in_each("attribute['id']").matches(
+        ['bat', 'dog', 'square', 'house', 'robot']
+    )
+
+@with_fixture("faulty.html")
+def parse_strategies(context):
+    "DOM(html, strategy) parses strictly, tolerantly, or checks first"
+    reset_parse_stats()
+
+    try:
+        DOM(context.html, 'strict')
+    except Exception:
+        pass
+    else:
+        raise AssertionError("strict parsing accepted a malformed document")
+
+    tolerant = DOM(context.html, 'tolerant')
+    auto = DOM(context.html)
+    assert that(auto.find("body *").length).equals(3)
+    assert that(tolerant.find("body *").length).equals(3)
+    assert that(parse_stats['tolerant']).equals(2)
+    assert that(parse_stats['malformed']).equals(1)
+    assert that(parse_stats['strict']).equals(0)
+
+    DOM("<html><body><p>fine</p></body></html>")
+    assert that(parse_stats['strict']).equals(1)
+    assert that(parse_stats['malformed']).equals(1)
@@ -25,7 +25,16 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 from sure import that
 from tests.base import with_fixture
-from dominic import DOM, Element
+from dominic import DOM, Element, ElementSet, selector_cache, SelectorSyntaxError
+from dominic import xpath, compile_selector, XPathTranslator, iterfind
+from dominic import bulk_extract, save_cache, load_cache
+from StringIO import StringIO
+import os
+import cPickle as pickle
+import tempfile
+from os.path import join, dirname
+from dominic.matcher import Matcher
+from dominic import cachefile
 
 @with_fixture("fixtures.html")
 def select_paragraphs(context):
@@ -378,3 +387,339 @@ def select_by_attribute_contains_prefix_with_quotes(context):
             'python-lettuce',
         ]
     )
+
+@with_fixture("divs.html")
+def dom_indexes_elements(context):
+    "DOM().index looks elements up by tag name, id and class"
+    dom = DOM(context.html)
+
+    assert that(dom.index.elements("li")).in_each("getAttribute('id')").matches(
+        ['ball', 'dog', 'square', 'house', 'puppet']
+    )
+    assert that(dom.index.by_id("objects")[0].tagName).equals('ul')
+    assert that(dom.index.by_class("geometry")).in_each("getAttribute('id')").matches(
+        ['ball', 'square']
+    )
+
+@with_fixture("divs.html")
+def selectors_are_compiled_once(context):
+    "selectors are translated and parsed once and then cached"
+    dom = DOM(context.html)
+    selector_cache.clear()
+
+    dom.find("ul#objects > li.geometry")
+    dom.find("ul#objects > li.geometry")
+    dom.get("ul#objects > li.geometry")
+
+    assert that(selector_cache.misses).equals(1)
+    assert that(selector_cache.hits).equals(2)
+
+@with_fixture("divs.html")
+def select_groups_of_selectors(context):
+    "selecting groups of selectors separated by commas"
+    dom = DOM(context.html)
+
+    elements = dom.find("#dog, p, #ball")
+    assert that(elements).in_each("attribute['id']").matches(
+        ['the-only-paragraph', 'ball', 'dog']
+    )
+
+@with_fixture("divs.html")
+def select_siblings(context):
+    "selecting adjacent and general siblings"
+    dom = DOM(context.html)
+
+    elements = dom.find("#dog + li")
+    assert that(elements).in_each("attribute['id']").matches(['square'])
+
+    elements = dom.find("#dog ~ li.geometry")
+    assert that(elements).in_each("attribute['id']").matches(['square'])
+
+@with_fixture("lists.html")
+def select_by_quoted_attribute_with_spaces(context):
+    "selecting by quoted attribute values containing spaces"
+    dom = DOM(context.html)
+
+    elements = dom.find("li[id='java island'], li[ id = \"coffee java\" ]")
+    assert that(elements).in_each("attribute['id']").matches(
+        ['java island', 'coffee java']
+    )
+
+@with_fixture("divs.html")
+def select_by_attribute_presence(context):
+    "selecting by the presence of an attribute"
+    dom = DOM(context.html)
+
+    elements = dom.find("#objects > li[class]")
+    assert that(elements).in_each("attribute['id']").matches(
+        ['ball', 'square', 'house']
+    )
+
+@with_fixture("divs.html")
+def select_by_class_matches_whole_words(context):
+    "selecting by class name only matches whole class names"
+    dom = DOM(context.html)
+
+    assert that(dom.find(".geometr")).equals([])
+    assert that(dom.find(".no-bullets").first().attribute['id']).equals('objects')
+
+@with_fixture("divs.html")
+def invalid_selectors_raise_syntax_errors(context):
+    "invalid selectors raise SelectorSyntaxError"
+    dom = DOM(context.html)
+
+    for selector in ["", "ul >", "li[id", "p:first", "p,,a"]:
+        try:
+            dom.find(selector)
+        except SelectorSyntaxError:
+            pass
+        else:
+            raise AssertionError("%r did not raise" % selector)
+
+@with_fixture("divs.html")
+def native_matching_agrees_with_xpath(context):
+    "selectors matched natively select the same elements as through XPath"
+    dom = DOM(context.html)
+
+    for selector in ["li", "div li", "div > ul > li.geometry", "*",
+                     "#objects li", "body *", ".ball", "[class~=dog]",
+                     "li[id^=s], p", "li[id$=e]", "li[id*=uppe]",
+                     "div ul, ul li", "ul > [class]", "html > head title"]:
+        finder = compile_selector(selector)
+        assert isinstance(finder, Matcher), selector
+        path = XPathTranslator(selector).path
+        assert that(finder.find(dom.document)).equals(
+            xpath.find(path, dom.document))
+
+    assert isinstance(compile_selector("#dog + li"), xpath.XPath)
+
+@with_fixture("divs.html")
+def streaming_selects_like_find(context):
+    "iterfind() selects the same elements as find(), while parsing"
+    dom = DOM(context.html)
+
+    for selector in ["li", "div", "div > ul li.geometry", "#objects, p",
+                     "body *", "html > head title"]:
+        streamed = list(iterfind(StringIO(context.html), selector))
+        expected = [x.element.toxml() for x in dom.find(selector)]
+        assert that([x.element.toxml() for x in streamed]).equals(expected)
+
+    for element in iterfind(StringIO(context.html), "ul"):
+        assert that(element.element.parentNode.documentElement).equals(
+            element.element)
+        assert that(element.element.getElementsByTagName("li")).len_is(5)
+
+        items = element.element.getElementsByTagName("li")
+        assert that(element.find("li").nodes).equals(list(items))
+        assert that(element.find(".geometry")).len_is(2)
+        assert that(element.get("li").element).equals(items[0])
+        assert element.exists("#dog")
+        assert not element.exists("p")
+
+    try:
+        list(iterfind(StringIO(context.html), "#dog + li"))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("sibling combinators did not raise")
+
+@with_fixture("divs.html")
+def find_many_selects_like_find(context):
+    "find_many() selects the same elements as find() for each selector"
+    dom = DOM(context.html)
+
+    selectors = {
+        'items': "li",
+        'geometry': "ul > li.geometry",
+        'by_id': "div #dog",
+        'classes': ".ball, .thing",
+        'group': "li[id^=s], #ball, li",
+        'everything': "body *",
+        'siblings': "#dog ~ li",
+        'nothing': "p li",
+    }
+    found = dom.find_many(selectors)
+    assert that(sorted(found.keys())).equals(sorted(selectors.keys()))
+    for name, selector in selectors.items():
+        assert that([x.element for x in found[name]]).equals(
+            [x.element for x in dom.find(selector)])
+
+@with_fixture("lists.html")
+def bulk_extract_values(context):
+    "bulk_extract() extracts text and attributes from many documents"
+    divs = join(dirname(__file__), "divs.html")
+    selectors = {'title': "title", 'ids': ("li", "id"),
+                 'classes': ("ul > li", "class")}
+
+    for workers in (0, 2):
+        results = list(bulk_extract([context.html, divs, context.html],
+                                    selectors, workers=workers, chunksize=1))
+        assert that([index for index, values, error in results]).equals(
+            [0, 1, 2])
+        assert that([error for index, values, error in results]).equals(
+            [None, None, None])
+        lists, divs_values = results[0][1], results[1][1]
+        assert that(lists['title']).equals([u'only lists'])
+        assert that(lists['ids'][:2]).equals(
+            [u'python-django', u'python-sponge'])
+        assert that(divs_values['classes']).equals(
+            [u'geometry', None, u'geometry', u'stuff thing', None])
+        assert that(results[2][1]).equals(lists)
+
+    results = bulk_extract([context.html] * 4, selectors, workers=2,
+                           ordered=False)
+    assert that(sorted(index for index, values, error in results)).equals(
+        [0, 1, 2, 3])
+
+@with_fixture("lists.html")
+def bulk_extract_reports_bad_documents(context):
+    "bulk_extract() reports the documents it can't parse and goes on"
+    sources = [context.html, "not markup at all", "<html><p>unclosed</html>",
+               context.html]
+
+    for workers in (0, 2):
+        results = list(bulk_extract(sources, {'title': "title"},
+                                    workers=workers, chunksize=1,
+                                    strategy='strict'))
+        assert that([index for index, values, error in results]).equals(
+            [0, 1, 2, 3])
+        assert that(results[0][1:]).equals(({'title': [u'only lists']}, None))
+        assert that(results[3][1:]).equals(results[0][1:])
+        assert that(results[1][1]).equals(None)
+        assert results[1][2].startswith('IOError: ')
+        assert that(results[2][1]).equals(None)
+        assert results[2][2].startswith('ExpatError: ')
+
+    for workers in (0, 2):
+        try:
+            bulk_extract([context.html], {'title': "title["}, workers=workers)
+        except SelectorSyntaxError:
+            pass
+        else:
+            raise AssertionError("invalid selector did not raise")
+
+@with_fixture("divs.html")
+def compiled_selectors_are_saved_to_a_cache_file(context):
+    "save_cache() saves compiled selectors for load_cache() to restore"
+    dom = DOM(context.html)
+    selectors = ["ul#objects > li.geometry", "#ball ~ li", "li + li"]
+    expected = [[x.element for x in dom.find(s)] for s in selectors]
+    selector_cache.clear()
+    xpath.XPath.cache.clear()
+    for selector in selectors:
+        compile_selector(selector)
+    xpath.XPath.get('//li[@id = "dog"]').compile()
+
+    filename = join(tempfile.mkdtemp(), 'selectors.cache')
+    save_cache(filename)
+    selector_cache.clear()
+    xpath.XPath.cache.clear()
+    assert that(load_cache(filename)).equals(4)
+    assert that(selector_cache.keys()).equals(selectors)
+    assert that(xpath.XPath.cache.keys()).equals(['//li[@id = "dog"]'])
+
+    found = [[x.element for x in dom.find(s)] for s in selectors]
+    assert that(found).equals(expected)
+    assert that(selector_cache.misses).equals(0)
+    assert that(dom.xpath('//li[@id = "dog"]')[0].attribute['id']).equals('dog')
+    assert that(xpath.XPath.cache.misses).equals(0)
+
+    os.remove(filename)
+    assert that(load_cache(filename)).equals(0)
+    os.rmdir(dirname(filename))
+
+@with_fixture("divs.html")
+def stale_cache_files_are_ignored(context):
+    "load_cache() ignores cache files of other versions and corrupt ones"
+    directory = tempfile.mkdtemp()
+    # A cache of another version, whose trees refer to a missing module,
+    # and a cache cut short.
+    old = join(directory, 'old.cache')
+    f = open(old, 'wb')
+    pickle.dump((cachefile.MAGIC, '0.0.1'), f)
+    f.write('cmissing.module\nExpr\n(tR.')
+    f.close()
+    corrupt = join(directory, 'corrupt.cache')
+    f = open(corrupt, 'wb')
+    pickle.dump((cachefile.MAGIC, cachefile.version), f)
+    f.write('\x80\x02}q\x01(U\x0bexpressionsq\x02]q\x03h')
+    f.close()
+    garbage = join(directory, 'garbage.cache')
+    f = open(garbage, 'wb')
+    f.write('not a pickle at all')
+    f.close()
+
+    for filename in (old, corrupt, garbage):
+        assert that(load_cache(filename)).equals(0)
+        os.remove(filename)
+    os.rmdir(directory)
+
+@with_fixture("divs.html")
+def element_sets_wrap_elements_on_access(context):
+    "ElementSet wraps the DOM nodes it holds as they are accessed"
+    dom = DOM(context.html)
+
+    items = dom.find("li")
+    assert that(items.length).equals(5)
+    assert that(items.nodes[0].tagName).equals("li")
+    assert that(items[1]).is_a(Element)
+    assert that(items[1:3]).is_a(ElementSet)
+    assert that(items[1:3]).in_each("attribute['id']").matches(
+        ['dog', 'square'])
+    assert that(items[-2:]).in_each("attribute['id']").matches(
+        ['house', 'puppet'])
+    assert items[2] in items
+    assert that([x.tag for x in items]).equals(["li"] * 5)
+
+@with_fixture("divs.html")
+def element_sets_behave_as_lists_of_elements(context):
+    "ElementSet takes and returns Elements through the list operations"
+    dom = DOM(context.html)
+
+    items = dom.find("li")
+    ids = ['ball', 'dog', 'square', 'house', 'puppet']
+    assert that([x.attribute['id'] for x in reversed(items)]).equals(
+        ids[::-1])
+    assert that(items.index(items[1])).equals(1)
+    assert that(items.count(items[1])).equals(1)
+    assert that(items[1]).equals(items[1])
+
+    both = items + dom.find("p")
+    assert that(both).is_a(ElementSet)
+    assert that(both.length).equals(6)
+    assert that(both[-1]).is_a(Element)
+    assert that(both[-1].tag).equals("p")
+
+    last = items.pop()
+    assert that(last).is_a(Element)
+    assert that(last.attribute['id']).equals('puppet')
+    assert that(items.length).equals(4)
+    items.remove(items[0])
+    items.append(last)
+    assert that([x.attribute['id'] for x in items]).equals(
+        ['dog', 'square', 'house', 'puppet'])
+
+@with_fixture("divs.html")
+def get_returns_the_first_match(context):
+    "get() returns the first matching element"
+    dom = DOM(context.html)
+
+    assert that(dom.get("li.geometry").attribute['id']).equals('ball')
+    assert that(dom.get(".thing, #dog").attribute['id']).equals('dog')
+    assert that(dom.get("#dog ~ li").attribute['id']).equals('square')
+    try:
+        dom.get("p li")
+    except IndexError:
+        pass
+    else:
+        raise AssertionError("get() did not raise IndexError")
+
+@with_fixture("divs.html")
+def exists_stops_at_the_first_match(context):
+    "exists() tells whether any element matches"
+    dom = DOM(context.html)
+
+    assert dom.exists("ul > li.geometry")
+    assert dom.exists("#dog ~ li")
+    assert not dom.exists("p li")
+    assert not dom.exists("#puppet + li")
@@ -3,6 +3,7 @@
 import unittest
 import xml.dom.minidom
 from dominic import xpath
+from xpath.expr import axes
 
 class TestAxes(unittest.TestCase):
     """Section 2.2: Axes"""
@@ -112,6 +113,23 @@ class TestAxes(unittest.TestCase):
 
         self.failUnlessEqual(a, b)
 
+    def test_reverse_axis_order(self):
+        node = xpath.findnode('//*[@id="2.2"]', self.doc)
+        result = [x for x in axes['preceding'](node)
+                  if x.nodeType == x.ELEMENT_NODE]
+        self.failUnlessEqual([x.getAttribute("id") for x in result],
+                             ["2.1.1", "2.1", "1.1.1", "1.1", "1"])
+
+    def test_deep_documents(self):
+        depth = 5000
+        doc = xml.dom.minidom.parseString(
+            '<a>' * depth + '<b/>' + '</a>' * depth)
+        self.failUnlessEqual(len(xpath.find('//a', doc)), depth)
+        b = xpath.findnode('//b', doc)
+        self.failUnlessEqual(len(xpath.find('preceding::*', b)), 0)
+        self.failUnlessEqual(len(xpath.find('/a/following::*', doc)), 0)
+        self.failUnlessEqual(len(list(axes['descendant'](doc))), depth + 1)
+
 if __name__ == '__main__':
     unittest.main()
 
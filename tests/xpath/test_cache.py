@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import unittest
+from dominic import xpath
+
+class TestLRUCache(unittest.TestCase):
+    """Least recently used cache."""
+
+    def setUp(self):
+        self.cache = xpath.LRUCache(3)
+        for key in 'abc':
+            self.cache[key] = key.upper()
+
+    def test_lookup_counts_hits_and_misses(self):
+        self.failUnlessEqual(self.cache['a'], 'A')
+        self.failUnlessRaises(KeyError, lambda: self.cache['z'])
+        self.failUnlessEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        self.cache['a']
+        self.cache['d'] = 'D'
+        self.failUnlessEqual(self.cache.keys(), ['c', 'a', 'd'])
+        self.failIf('b' in self.cache)
+
+    def test_update_refreshes_item(self):
+        self.cache['a'] = 'alpha'
+        self.cache['d'] = 'D'
+        self.failUnlessEqual(self.cache.keys(), ['c', 'a', 'd'])
+        self.failUnlessEqual(self.cache['a'], 'alpha')
+
+    def test_shrinking_capacity_evicts(self):
+        self.cache.capacity = 1
+        self.failUnlessEqual(self.cache.keys(), ['c'])
+
+    def test_zero_capacity_disables_caching(self):
+        cache = xpath.LRUCache(0)
+        cache['a'] = 'A'
+        self.failUnlessEqual(len(cache), 0)
+
+    def test_clear(self):
+        self.cache['a']
+        self.cache.clear()
+        self.failUnlessEqual(len(self.cache), 0)
+        self.failUnlessEqual((self.cache.hits, self.cache.misses), (0, 0))
+
+    def test_stats(self):
+        self.cache.add('d', 'D', 0.5)
+        self.cache['d']
+        self.cache['d']
+        stats = self.cache.stats()
+        self.failUnlessEqual(stats['evictions'], 1)
+        self.failUnlessEqual(stats['hits'], 2)
+        self.failUnlessEqual(stats['saved'], 1.0)
+        self.failUnlessEqual(stats['size'], 3)
+
+    def test_threads_share_the_cache(self):
+        import threading
+        cache = xpath.LRUCache(50)
+
+        def work(n):
+            for i in xrange(500):
+                key = (n * i) % 80
+                try:
+                    cache[key]
+                except KeyError:
+                    cache[key] = i
+
+        threads = [threading.Thread(target=work, args=(n,))
+                   for n in xrange(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.failUnlessEqual(len(cache), len(cache.keys()))
+        self.failUnless(len(cache) <= 50)
+        self.failUnlessEqual(cache.hits + cache.misses, 2000)
+
+class TestExpressionCache(unittest.TestCase):
+    """XPath.get() expression cache."""
+
+    def setUp(self):
+        self.capacity = xpath.XPath.cache.capacity
+        xpath.XPath.cache.clear()
+
+    def tearDown(self):
+        xpath.XPath.cache.capacity = self.capacity
+
+    def test_get_reuses_compiled_expressions(self):
+        expr = xpath.XPath.get('//item[@id=1]')
+        self.failUnless(xpath.XPath.get('//item[@id=1]') is expr)
+        self.failUnlessEqual(xpath.XPath.cache.hits, 1)
+        self.failUnlessEqual(xpath.XPath.cache.saved, expr.parse_time)
+
+    def test_cycling_past_capacity_keeps_recent_expressions(self):
+        xpath.XPath.cache.capacity = 10
+        for i in xrange(11):
+            xpath.XPath.get('//item[%d]' % i)
+        self.failUnlessEqual(len(xpath.XPath.cache), 10)
+        xpath.XPath.get('//item[10]')
+        self.failUnlessEqual(xpath.XPath.cache.hits, 1)
+
+    def test_prewarm(self):
+        compiled = xpath.XPath.prewarm(['//item', 'count(//item)'])
+        self.failUnlessEqual([str(x) for x in compiled],
+                             ['/descendant-or-self::node()/child::item',
+                              'count(/descendant-or-self::node()/child::item)'])
+        self.failUnless(xpath.XPath.get('//item') is compiled[0])
+        self.failUnlessRaises(xpath.XPathParseError,
+                              xpath.XPath.prewarm, ['//item['])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import unittest
+import xml.dom.minidom
+from dominic import xpath
+from xpath.compact import CompactDocument
+
+class TestCompactDocument(unittest.TestCase):
+    """Evaluating expressions on a CompactDocument."""
+
+    xml = """<?xml version="1.0"?>
+<doc xmlns:a="http://www.example.com/a">
+    <?pi data?>
+    <chapter id="1" title="one">
+        <!-- comment -->
+        <para>first <b>bold</b> text</para>
+        <a:para id="1.2" a:attr="x" />
+    </chapter>
+    <chapter id="2">
+        <para id="2.1">second</para>
+        <para id="2.2">&lt;third&gt;</para>
+    </chapter>
+</doc>
+"""
+
+    expressions = [
+        '//node()', '//*', '//text()', '//comment()',
+        '//processing-instruction()', '//@id', '//@title', '//para', '//a:para',
+        '//@a:attr', '//chapter[2]/para[last()]', '//para[. = "second"]',
+        '//b/ancestor::*', '//b/following::node()', '//b/preceding::*',
+        '//para/preceding-sibling::*', '//chapter/following-sibling::*',
+        '//*[@id][position() > 1]', '//@id/..', '//b | //chapter',
+        'string(/)', 'string(//chapter)', 'count(//*)', 'sum(//@id)',
+        'name(//a:para)', 'local-name(//@a:attr)', 'namespace-uri(//a:para)',
+        'normalize-space(//chapter[1])', 'string(//para[3])',
+    ]
+
+    def setUp(self):
+        self.context = xpath.XPathContext(
+            namespaces={'a':'http://www.example.com/a'})
+        self.minidom = xml.dom.minidom.parseString(self.xml)
+        self.compact = CompactDocument.fromstring(self.xml)
+
+    def describe(self, value):
+        if not isinstance(value, list):
+            return value
+        return [(x.nodeType, x.nodeName, xpath.expr.string_value(x))
+                for x in value]
+
+    def test_same_results_as_minidom(self):
+        for expr in self.expressions:
+            self.failUnlessEqual(
+                self.describe(self.context.find(expr, self.compact)),
+                self.describe(self.context.find(expr, self.minidom)),
+                expr)
+
+    def test_nodes_are_numbered_in_document_order(self):
+        nodes = self.context.find('//node() | //@*', self.compact)
+        self.failUnlessEqual([x.index for x in nodes],
+                             range(1, len(self.compact)))
+
+    def test_handles_are_shared(self):
+        first = xpath.findnode('//para', self.compact)
+        self.failUnless(first is xpath.findnode('//chapter/para',
+                                                self.compact))
+        self.failUnless(first.parentNode is first.parentNode)
+
+    def test_text_content(self):
+        chapter = xpath.findnode('//chapter', self.compact)
+        self.failUnlessEqual(chapter.textContent.split(),
+                             ['first', 'bold', 'text'])
+        self.failUnlessEqual(self.compact.documentElement.tagName, 'doc')
+
+    def test_attributes(self):
+        for expr in ('//chapter[1]', '//a:para', '//b'):
+            element = self.context.findnode(expr, self.compact)
+            attrs = element.attributes
+            expected = self.context.findnode(expr, self.minidom).attributes
+            self.failUnlessEqual(attrs.length, expected.length, expr)
+            # In source order, where minidom's order is that of a dict.
+            self.failUnlessEqual(
+                sorted((attrs.item(i).name, attrs.item(i).value)
+                       for i in range(attrs.length)),
+                sorted((expected.item(i).name, expected.item(i).value)
+                       for i in range(expected.length)), expr)
+            self.failUnlessEqual([x.name for x in attrs],
+                                 [attrs.item(i).name
+                                  for i in range(attrs.length)])
+            self.failUnless(attrs.item(attrs.length) is None)
+            self.failUnless(attrs.item(-1) is None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+import unittest
+import xml.dom.minidom
+from dominic import xpath
+from xpath.expr import constantp
+
+class TestCompile(unittest.TestCase):
+    """Expressions compiled into closures."""
+
+    xml = """
+<doc>
+    <item n="1" class="odd">one</item>
+    <item n="2" class="even">two</item>
+    <item n="3" class="odd">three</item>
+    <group><item n="4" class="even">four</item></group>
+</doc>
+"""
+
+    expressions = [
+        '//item[@class = "odd"]', '//item[@n > 1]', '//item["2" = @n]',
+        '//item[@n = 1 + 1]', '//item[. = "three"]', '//item[@n != 2]',
+        '//item[not(@class = "even")][last()]', '//*[item][1]',
+        '//item[contains(concat("o", "n"), "n") and @n < 3]',
+        '//item[string-length() = 3]', '//item[@missing = ""]',
+        'count(//item[number(@n) * 2 > 4])', 'sum(//@n) div count(//item)',
+        '//item[position() mod 2 = 1]/@n', '//@n | //group', '-(3 - 4)',
+        'string(//item)', 'name(//group/*)', '//item[@n = //item/@n]',
+        'substring("12345", 2, 3)', 'translate("abc", "b", "B")',
+    ]
+
+    def setUp(self):
+        self.doc = xml.dom.minidom.parseString(self.xml)
+
+    def test_compiled_values(self):
+        for expr in self.expressions:
+            interpreted = xpath.XPath(expr).find(self.doc)
+            compiled = xpath.XPath(expr).compile()
+            self.failUnless(compiled.compiled)
+            self.failUnlessEqual(compiled.find(self.doc), interpreted, expr)
+            if isinstance(interpreted, list):
+                self.failUnlessEqual(list(compiled.iterate(self.doc)),
+                                     interpreted, expr)
+
+    def test_constant_folding(self):
+        compiled = xpath.XPath('concat("a", string(1 + 2))').expr.compile()
+        self.failUnless(constantp(compiled))
+        self.failUnlessEqual(compiled.value, 'a3')
+        compiled = xpath.XPath('position() + 1').expr.compile()
+        self.failIf(constantp(compiled))
+
+    def test_errors_are_raised_when_evaluated(self):
+        compiled = xpath.XPath('1 | 2').compile()
+        self.failUnlessRaises(xpath.XPathTypeError, compiled.find, self.doc)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import unittest
+import xml.dom.minidom
+from dominic import xpath
+
+class TestDocumentContext(unittest.TestCase):
+    """Sharing namespace discovery between the queries on a document."""
+
+    xml = """
+<doc xmlns="http://example.com/default" xmlns:x="http://example.com/x">
+    <para id="1" />
+    <x:para id="2" />
+</doc>
+"""
+
+    def setUp(self):
+        self.doc = xml.dom.minidom.parseString(self.xml)
+
+    def ids(self, nodes):
+        return [x.getAttribute("id") for x in nodes]
+
+    def test_context_is_shared(self):
+        para = xpath.findnode("//para", self.doc)
+        context = xpath.document_context(self.doc)
+        self.failUnless(xpath.document_context(para) is context)
+        self.failUnlessEqual(context.default_namespace,
+                             "http://example.com/default")
+        self.failUnlessEqual(context.namespaces,
+                             {"x": "http://example.com/x"})
+
+    def test_new_contexts_are_copies(self):
+        context = xpath.XPathContext(self.doc)
+        context.namespaces["y"] = "http://example.com/y"
+        self.failIf("y" in xpath.document_context(self.doc).namespaces)
+        self.failUnlessEqual(self.ids(xpath.find("//x:para", self.doc)),
+                             ["2"])
+
+    def test_query_arguments(self):
+        result = xpath.find("//y:para", self.doc,
+                            namespaces={"y": "http://example.com/x"})
+        self.failUnlessEqual(self.ids(result), ["2"])
+        self.failIf("y" in xpath.document_context(self.doc).namespaces)
+
+    def test_invalidate(self):
+        xpath.find("//para", self.doc)
+        self.doc.documentElement.setAttribute("xmlns:x",
+                                              "http://example.com/other")
+        xpath.invalidate(self.doc.documentElement)
+        self.failUnlessEqual(xpath.find("//x:para", self.doc), [])
+
+if __name__ == '__main__':
+    unittest.main()
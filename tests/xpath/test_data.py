@@ -123,5 +123,37 @@ class TestDataModel(unittest.TestCase):
         result = self.context.find('local-name(//element/text())', self.doc)
         self.failUnlessEqual(result, "")
 
+class TestStringValueMemo(unittest.TestCase):
+    """Memoized string-values within a query."""
+
+    xml = """
+<doc>
+    <chapter>one <b>two</b> <i>three <b>four</b></i></chapter>
+    <chapter><b>four</b></chapter>
+</doc>
+"""
+
+    def setUp(self):
+        self.doc = xml.dom.minidom.parseString(self.xml)
+        self.context = xpath.XPathContext(self.doc)
+        self.context.memoize = True
+
+    def test_memo_fills_in_descendants(self):
+        chapter = xpath.findnode('/doc/chapter', self.doc)
+        memo = {}
+        value = xpath.expr.string_value(chapter, memo)
+        self.failUnlessEqual(value, xpath.expr.string_value(chapter))
+        self.failUnlessEqual(value, "one two three four")
+        self.failUnlessEqual(len(memo), 4)
+        italic = xpath.findnode('.//i', chapter)
+        self.failUnlessEqual(memo[italic], "three four")
+
+    def test_memoized_queries(self):
+        for expr in ('//*[. = "four"]', '//*[. = "three four"]',
+                     '//*[string() != ""]', '//*[contains(., "one")]'):
+            self.failUnlessEqual(self.context.find(expr, self.doc),
+                                 xpath.find(expr, self.doc))
+        self.failUnlessEqual(self.context.string_values, None)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+import unittest
+import xml.dom.minidom
+from dominic import xpath
+from xpath.expr import document_order, merge_nodesets, sort_nodeset
+
+class TestDocumentOrder(unittest.TestCase):
+    """Integer document order ranks."""
+
+    xml = """
+<doc id="0">
+    <chapter id="1" title="one">
+        <section id="1.1" />
+    </chapter>
+    <chapter id="2">
+        <section id="2.1" />
+    </chapter>
+</doc>
+"""
+
+    def setUp(self):
+        self.doc = xml.dom.minidom.parseString(self.xml)
+
+    def test_ranks_follow_document_order(self):
+        nodes = xpath.find('//node()', self.doc)
+        ranks = [document_order(x) for x in nodes]
+        self.failUnlessEqual(ranks, sorted(ranks))
+        self.failUnlessEqual(len(set(ranks)), len(ranks))
+
+    def test_attributes_come_before_children(self):
+        chapter = xpath.findnode('//chapter[@id="1"]', self.doc)
+        section = xpath.findnode('section', chapter)
+        for attr in xpath.find('@*', chapter):
+            self.failUnless(document_order(chapter) < document_order(attr))
+            self.failUnless(document_order(attr) < document_order(section))
+
+    def test_added_nodes_are_ranked(self):
+        document_order(self.doc)
+        chapter = xpath.findnode('//chapter[@id="1"]', self.doc)
+        item = self.doc.createElement('item')
+        chapter.appendChild(item)
+        result = xpath.find('//item | //section', self.doc)
+        self.failUnlessEqual([x.getAttribute('id') or x.tagName
+                              for x in result],
+                             ['1.1', 'item', '2.1'])
+
+    def added_nodes(self):
+        """Return a document ranked before nodes were added to it."""
+        doc = xml.dom.minidom.parseString(
+            '<doc><a><x/></a><b><y/><z/></b><c><w/></c></doc>')
+        xpath.find('//*', doc)
+        a, b = doc.documentElement.childNodes[:2]
+        for name in ('n0', 'n1', 'n2'):
+            a.appendChild(doc.createElement(name))
+        b.insertBefore(doc.createElement('n3'), b.lastChild)
+        return doc
+
+    def test_paths_stay_in_order_after_adding_nodes(self):
+        for expr, names in [
+            ('//a/* | //b/*', 'x n0 n1 n2 y n3 z'),
+            ('//*', 'doc a x n0 n1 n2 b y n3 z c w'),
+            ('/doc/*/*', 'x n0 n1 n2 y n3 z w'),
+            ('//node()', 'doc a x n0 n1 n2 b y n3 z c w')]:
+            result = xpath.find(expr, self.added_nodes())
+            self.failUnlessEqual([x.tagName for x in result], names.split(),
+                                 expr)
+
+    def test_removed_nodes_are_forgotten(self):
+        doc = self.added_nodes()
+        index = doc._xpath_document_order
+        a = doc.documentElement.firstChild
+        doc.documentElement.removeChild(a)
+        c = doc.documentElement.lastChild
+        c.appendChild(doc.createElement('v'))
+        result = xpath.find('//*', doc)
+        self.failUnlessEqual([x.tagName for x in result],
+                             'doc b y n3 z c w v'.split())
+        self.failIf(a in index)
+        self.failIf(a.firstChild in index)
+
+    def test_invalidate_after_moving_nodes(self):
+        document_order(self.doc)
+        first = xpath.findnode('//chapter[@id="1"]', self.doc)
+        self.doc.documentElement.appendChild(first)
+        xpath.invalidate(first)
+        result = xpath.find('//section | //chapter', self.doc)
+        self.failUnlessEqual([x.getAttribute('id') for x in result],
+                             ['2', '2.1', '1', '1.1'])
+
+    def test_detached_nodes(self):
+        chapter = self.doc.createElement('chapter')
+        section = self.doc.createElement('section')
+        chapter.appendChild(section)
+        self.failUnless(document_order(chapter) < document_order(section))
+
+    def test_nodes_of_different_trees_are_kept(self):
+        # The detached chapter is ranked like the document, in its own
+        # tree: equal ranks don't make them the same node.
+        chapter = self.doc.createElement('chapter')
+        self.failUnlessEqual(document_order(chapter),
+                             document_order(self.doc))
+        merged = merge_nodesets([[self.doc], [chapter, chapter]])
+        self.failUnlessEqual(len(merged), 2)
+        self.failUnlessEqual(len(sort_nodeset([chapter, self.doc, chapter])),
+                             2)
+
+    def test_unions_of_different_trees_are_streamed(self):
+        chapter = self.doc.createElement('chapter')
+        variables = {'a': [self.doc], 'b': [chapter]}
+        found = xpath.find('$a | $b', self.doc, **variables)
+        self.failUnlessEqual(len(found), 2)
+        self.failUnlessEqual(list(xpath.iterate('$a | $b', self.doc,
+                                                **variables)), found)
+
+if __name__ == '__main__':
+    unittest.main()
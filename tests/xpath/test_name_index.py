@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import unittest
+import xml.dom.minidom
+from dominic import xpath
+
+class TestNameIndex(unittest.TestCase):
+    """Looking elements up through a document's NameIndex."""
+
+    xml = """
+<doc>
+    <para id="1" class="intro first" />
+    <div id="2">
+        <para id="3" class="intro" />
+        <para id="4" />
+    </div>
+    <note id="5"><para id="6" /></note>
+    <para id="3" />
+</doc>
+"""
+
+    def setUp(self):
+        self.doc = xml.dom.minidom.parseString(self.xml)
+        self.index = xpath.name_index(self.doc)
+
+    def ids(self, nodes):
+        return [x.getAttribute("id") for x in nodes]
+
+    def test_elements_by_name(self):
+        self.failUnlessEqual(self.ids(self.index.elements("para")),
+                             ["1", "3", "4", "6", "3"])
+        self.failUnlessEqual(self.index.elements("missing"), [])
+
+    def test_elements_by_id(self):
+        self.failUnlessEqual(self.ids(self.index.by_id("3")), ["3", "3"])
+        self.failUnlessEqual(self.index.by_id("missing"), [])
+
+    def test_elements_by_class(self):
+        self.failUnlessEqual(self.ids(self.index.by_class("intro")),
+                             ["1", "3"])
+        self.failUnlessEqual(self.ids(self.index.by_class("first")), ["1"])
+
+    def test_descendant_names(self):
+        result = xpath.find("//para", self.doc)
+        self.failUnlessEqual(self.ids(result), ["1", "3", "4", "6", "3"])
+
+    def test_descendant_names_with_predicates(self):
+        result = xpath.find("//para[@class]", self.doc)
+        self.failUnlessEqual(self.ids(result), ["1", "3"])
+        result = xpath.find("//para[2]", self.doc)
+        self.failUnlessEqual(self.ids(result), ["4", "3"])
+
+    def test_descendant_ids(self):
+        result = xpath.find("//*[@id='3']", self.doc)
+        self.failUnlessEqual(len(result), 2)
+        result = xpath.find("//div[@id='3']", self.doc)
+        self.failUnlessEqual(result, [])
+        result = xpath.find("//*[@id='4']/..", self.doc)
+        self.failUnlessEqual(self.ids(result), ["2"])
+
+    def test_invalidate(self):
+        xpath.find("//para", self.doc)
+        para = self.doc.createElement("para")
+        para.setAttribute("id", "7")
+        self.doc.documentElement.appendChild(para)
+        xpath.invalidate(para)
+        result = xpath.find("//para[@id='7']", self.doc)
+        self.failUnlessEqual(result, [para])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@
 import unittest
 import xml.dom.minidom
 from dominic import xpath
+from xpath.expr import NameTest, axes
 
 class TestNameTests(unittest.TestCase):
     """Section 2.3: Node Tests (Name Tests)"""
@@ -108,6 +109,17 @@ class TestNameTests(unittest.TestCase):
                              ["red", "orange", "yellow", "green", "blue",
                               "indigo", "violet", "brown"])
 
+    def test_matchers_follow_the_context(self):
+        test = NameTest('b', 'item')
+        axis = axes['child']
+        match = test.matcher(axis, self.context)
+        self.failUnless(test.matcher(axis, self.context) is match)
+        other = xpath.XPathContext(namespaces={'b': 'http://a.example.com'})
+        self.failIf(test.matcher(axis, other) is match)
+        result = other.find('/descendant::b:item', self.docns)
+        self.failUnlessEqual([x.getAttribute("id") for x in result],
+                             ["1", "2", "4", "8"])
+
 class TestKindTests(unittest.TestCase):
     """Section 2.3: Node Tests (Kind Tests)"""
 
@@ -404,5 +404,77 @@ class PathsTestCase(unittest.TestCase):
         self.failUnlessEqual([x.getAttribute("id") for x in result],
                              ["4"])
 
+    def test_nested_descendants_are_merged(self):
+        doc = xml.dom.minidom.parseString("""
+            <doc>
+                <ul id="1">
+                    <li id="2"><a id="3" /></li>
+                    <li id="4">
+                        <ul id="5"><li id="6"><a id="7" /></li></ul>
+                        <a id="8" />
+                    </li>
+                </ul>
+                <li id="9"><a id="10" /></li>
+            </doc>
+        """).documentElement
+        result = xpath.find("//ul//li//a", doc)
+        self.failUnlessEqual([x.getAttribute("id") for x in result],
+                             ["3", "7", "8"])
+
+    def test_union_of_overlapping_node_sets(self):
+        doc = xml.dom.minidom.parseString("""
+            <doc>
+                <chapter id="1"><title id="2" /></chapter>
+                <chapter id="3"><title id="4" /></chapter>
+            </doc>
+        """).documentElement
+        result = xpath.find("//title | //chapter | //*[@id=3]", doc)
+        self.failUnlessEqual([x.getAttribute("id") for x in result],
+                             ["1", "2", "3", "4"])
+
+    def test_lazy_evaluation(self):
+        doc = xml.dom.minidom.parseString("""
+            <doc>
+                <ul id="1"><li id="2" /><li id="3"><a id="4" /></li></ul>
+                <ul id="5"><li id="6"><ul id="7"><li id="8" /></ul></li></ul>
+                <p id="9"><a id="10" /><a id="11" /></p>
+            </doc>
+        """)
+        for expr in ("//ul//li", "//li/..", "//ul/li[2]", "//li[a]",
+                     "//ul//li | //a", "//a/following::*", "/doc/*/@id",
+                     "//a/preceding-sibling::*", "(//li)[last()]/@id"):
+            self.failUnlessEqual(list(xpath.iterate(expr, doc)),
+                                 xpath.find(expr, doc), expr)
+
+        nodes = xpath.iterate("//li", doc)
+        self.failUnlessEqual(next(nodes).getAttribute("id"), "2")
+        self.failUnlessEqual(next(nodes).getAttribute("id"), "3")
+        self.failUnlessEqual(xpath.findnode("//ul//li", doc),
+                             xpath.find("//ul//li", doc)[0])
+        self.failUnless(xpath.exists("//ul/li/a", doc))
+        self.failIf(xpath.exists("//p/li", doc))
+        self.failUnlessRaises(xpath.XPathTypeError,
+                              xpath.iterate, "count(//li)", doc)
+
+    def test_descendant_steps_are_fused(self):
+        doc = xml.dom.minidom.parseString("""
+            <doc>
+                <div id="1"><para id="2" /><para id="3" /></div>
+                <div id="4"><div id="5"><para id="6" /></div></div>
+            </doc>
+        """).documentElement
+        path = xpath.XPath("div//para[@id][1]//para[@id > 2]").expr
+        self.failUnlessEqual(
+            [str(x) for x in path.fused(1)],
+            ["descendant-or-self::node()", "child::para[attribute::id][1]",
+             "descendant::para[(attribute::id > 2)]"])
+        for expr, ids in (("//div//para", ["2", "3", "6"]),
+                          ("//div//para[1]", ["2", "6"]),
+                          ("//div//para[@id != 2]", ["3", "6"]),
+                          (".//div/para[last()]", ["3", "6"])):
+            result = xpath.find(expr, doc)
+            self.failUnlessEqual([x.getAttribute("id") for x in result],
+                                 ids, expr)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import unittest
+import xml.dom.minidom
+import xpath
+import xpath.pratt
+from xpath.yappsrt import SyntaxError
+
+class TestPratt(unittest.TestCase):
+    """The precedence parser builds the trees of the yapps parser."""
+
+    expressions = [
+        '//para[@type="warning"][5]', 'child::*[self::chapter or self::appendix]',
+        '1 div 2 mod 3 * 4', '1 - 2 - 3', '8 div 2 div 2', '-1 - -2',
+        'a or b and c or d', '1 < 2 = 3 > 4', 'a=b', 'a!=b', '-a|b|c',
+        'div div div', '*/mod', '- - 1', 'a-b', '@a-(1)', 'a orb',
+        '$x:y', '$a[1]', '@*', '@a:*', '*:b', '/', '/ and x', '/*',
+        'node() | text() | comment() | processing-instruction("pi")',
+        'processing-instruction(pi)', 'processing-instruction()',
+        'ancestor-or-self::x[1]/following-sibling::*', 'and or and',
+        'x/and', "concat('a', \"b\")[1]", '(a|b)[2]/c', 'f()', '.[1]',
+        '..//.', 'a//b//c', '//node', 'a::b', 'f(', 'f(,1)', 'f(1,)',
+        '1 +', '"unterminated', '@', '#', '()', 'a[]', '',
+    ]
+
+    def parse(self, parse, expr):
+        try:
+            return str(parse(expr))
+        except SyntaxError, e:
+            return (e.pos, e.msg)
+        except xpath.XPathError, e:
+            return str(e)
+
+    def test_same_trees(self):
+        for expr in self.expressions:
+            self.failUnlessEqual(
+                self.parse(xpath.pratt.parse, expr),
+                self.parse(xpath.parsers['yapps'], expr), expr)
+
+    def test_select_parser(self):
+        doc = xml.dom.minidom.parseString('<doc/>')
+        for name in ('yapps', 'pratt'):
+            expr = xpath.XPath('1 + 2 * 3', parser=name)
+            self.failUnlessEqual(expr.find(doc), 7)
+        self.assertRaises(xpath.XPathParseError, xpath.XPath, 'a[',
+                          parser='pratt')
+
+if __name__ == '__main__':
+    unittest.main()
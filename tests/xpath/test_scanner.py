@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+import unittest
+import xpath.parser
+import xpath.scanner
+from xpath.yappsrt import SyntaxError
+
+class TestScanner(unittest.TestCase):
+    """The combined scanner yields the tokens of the yapps scanner."""
+
+    expressions = [
+        '//para[@type="warning"][5]', 'child::*[self::chapter or self::appendix]',
+        '1 div 2 mod 3 * 4', 'div div div', '*/mod', '- - 1', '-x - y',
+        'a-b', 'a - b', '1.5e3 + .5 - 2.', '$x:y', '@*', '@a:*', '*:b',
+        'node() | text() | comment() | processing-instruction("pi")',
+        'ancestor-or-self::x[1]/following-sibling::*', 'and or and',
+        'x/and', "concat('a', \"b\")", '  //a  ', '..//.', 'a::b',
+        'f(', '1 +', '"unterminated', '@', '#',
+    ]
+
+    def scan(self, scanner, expr):
+        s = scanner(expr)
+        try:
+            result = str(xpath.parser.XPath(s).XPath())
+        except SyntaxError, e:
+            result = (e.pos, e.msg)
+        return result, s.tokens
+
+    def test_same_tokens(self):
+        for expr in self.expressions:
+            self.failUnlessEqual(
+                self.scan(xpath.scanner.XPathScanner, expr),
+                self.scan(xpath.parser.XPathScanner, expr), expr)
+
+if __name__ == '__main__':
+    unittest.main()